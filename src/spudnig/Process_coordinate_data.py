@@ -19,6 +19,8 @@ import os
 import pdb
 import ffmpeg
 
+import keypoint_store
+
 plt.rc('xtick', labelsize=12)
 plt.rc('ytick', labelsize=12)
 
@@ -36,6 +38,7 @@ DataFolders = os.listdir(mainDir)
 #FILENAMES = ['Left_Hand_t.csv', 'Right_Hand_t.csv']
 #HANDS = ['L_Hand', 'R_Hand']
 #we'll use the files generated for Jordy's project, which use different filenames
+#spudnig_new only writes these CSVs with --csv, the coordinates are read from its keypoint store instead
 FILENAMES = ['hand_left_sample.csv', 'hand_right_sample.csv']
 HANDS = ['L_Hand', 'R_Hand']
 
@@ -54,6 +57,15 @@ def import_coordinates(csv_file, Hand_variable):
     return (Hand_variable)
 
 
+def import_keypoints(folder):
+    """
+    Returns the x and y of the first keypoint of the left and the right hand in
+    every frame, from the keypoint store spudnig_new writes in folder.
+    """
+    _, data = keypoint_store.load(folder)
+    return data['hand_left'][:, 0, :2].tolist(), data['hand_right'][:, 0, :2].tolist()
+
+
 def calculate_distance(Hand):
     """
     This just calculates the displacement between each set of points, then the
@@ -110,11 +122,7 @@ def animate(i):
 
 def main():
 
-    for file in FILENAMES:
-        if "left" in file:
-            L_Hand = import_coordinates(mainDir + DataFolders[0] + "/" + file, L_Hand)
-        else:
-            R_Hand = import_coordinates(mainDir + DataFolders[0] + "/" + file, R_Hand)
+    L_Hand, R_Hand = import_keypoints(mainDir + DataFolders[0])
 
 
 
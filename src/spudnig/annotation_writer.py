@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Writes detected movements straight to ELAN (.eaf) and JSON files.
+
+The movements are given as runs (see movements2.runs): arrays with the first frame of every
+movement and the frame after its last frame. Times are computed for all movements at once and
+the files are written line by line, without building a table first.
+"""
+import datetime
+import json
+import os
+
+import numpy as np
+
+import movements2
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+                        'templates', 'BlankTemplate.eaf')
+
+TIER = 'Movements'
+ANNOTATION = 'movement'
+
+
+def movement_times(starts, ends, frames, fps):
+    """Returns the begin and end times in ms of the movements that elan_writer writes. The end time is the
+    time of the last frame of a movement; a movement that lasts until the last frame ends there."""
+    keep = starts < frames - 1
+    return (movements2.frames_to_ms(starts[keep], fps),
+            movements2.frames_to_ms(np.minimum(ends[keep], frames) - 1, fps))
+
+
+def write_eaf(savefile, starts, ends, frames, fps, video, template=TEMPLATE, author=''):
+    """Writes the movements as annotations of the Movements tier of templates/BlankTemplate.eaf."""
+    # xml.sax imports urllib, which is slow to import
+    from xml.sax.saxutils import quoteattr
+
+    begin, end = movement_times(starts, ends, frames, fps)
+    with open(template, 'r', encoding='utf-8') as template_file:
+        text = template_file.read()
+
+    # the template leaves these attributes without a value
+    text = text.replace('AUTHOR= ', 'AUTHOR={} '.format(quoteattr(author)), 1)
+    text = text.replace('DATE= ', 'DATE={} '.format(quoteattr(datetime.datetime.now().isoformat())), 1)
+    text = text.replace('MEDIA_FILE= ', 'MEDIA_FILE="" ', 1)
+    text = text.replace('MEDIA_URL= ', 'MEDIA_URL={} '.format(quoteattr('file:///' + video.replace('\\', '/'))), 1)
+    text = text.replace('<PROPERTY NAME="lastUsedAnnotationId">3</PROPERTY>',
+                        '<PROPERTY NAME="lastUsedAnnotationId">{}</PROPERTY>'.format(len(begin)), 1)
+
+    time_order = text.index('<TIME_ORDER>') + len('<TIME_ORDER>\n')
+    tier = text.index('TIER_ID="{}">'.format(TIER)) + len('TIER_ID="{}">\n'.format(TIER))
+    times = np.empty(2 * len(begin), dtype=np.int64)
+    times[0::2] = begin
+    times[1::2] = end
+
+    with open(savefile, 'w', encoding='utf-8') as eaf:
+        eaf.write(text[:time_order])
+        eaf.writelines('        <TIME_SLOT TIME_SLOT_ID="ts{}" TIME_VALUE="{}"/>\n'.format(slot, time)
+                       for slot, time in enumerate(times.tolist(), 1))
+        eaf.write(text[time_order:tier])
+        eaf.writelines('        <ANNOTATION>\n'
+                       '            <ALIGNABLE_ANNOTATION ANNOTATION_ID="a{0}" TIME_SLOT_REF1="ts{1}" '
+                       'TIME_SLOT_REF2="ts{2}">\n'
+                       '                <ANNOTATION_VALUE>{3}</ANNOTATION_VALUE>\n'
+                       '            </ALIGNABLE_ANNOTATION>\n'
+                       '        </ANNOTATION>\n'.format(a, 2 * a - 1, 2 * a, ANNOTATION)
+                       for a in range(1, len(begin) + 1))
+        eaf.write(text[tier:])
+
+
+def write_json(savefile, starts, ends, frames, fps):
+    """Writes the movements in the JSON layout of the UI: an object with one entry per movement, holding its
+    tier, start and end time and type."""
+    begin, end = movement_times(starts, ends, frames, fps)
+    times = zip(movements2.format_ms(begin), movements2.format_ms(end))
+    with open(savefile, 'w', encoding='utf-8') as json_file:
+        json_file.write('{')
+        for i, (start_time, end_time) in enumerate(times):
+            movement = {'TIER': TIER, 'START_TIME': start_time, 'END_TIME': end_time, 'TYPE': ANNOTATION}
+            json_file.write('{}\n\t{}: {}'.format(',' if i else '', json.dumps(str(i)), json.dumps(movement)))
+        json_file.write('\n}\n')
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Analyses a corpus of videos: every video in a folder, or every video listed in a manifest.
+
+Pose estimation (OpenPose and ingesting its output) and the movement analysis are separate
+stages with their own number of concurrent jobs. OpenPose runs in threads that each wait for an
+OpenPose process, while finished videos are analysed in a pool of worker processes, so videos
+are analysed while later videos are still in pose estimation. Every video gets its own result
+file in the save folder, and summary.csv there lists the outcome of every video.
+"""
+import argparse
+import atexit
+import multiprocessing
+import os
+import posixpath
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import keypoint_store
+import movements2
+import online_movements
+import pose_cache
+import progress
+import spudnig_new
+
+VIDEO_EXTENSIONS = ('.avi', '.mkv', '.mov', '.mp4', '.mpeg', '.mpg', '.wmv')
+
+SUMMARY_COLUMNS = ['video', 'status', 'result', 'frames', 'fps', 'movements', 'pose_seconds', 'analysis_seconds',
+                   'error']
+
+
+def find_videos(source):
+    """Returns the videos in a folder, or the videos listed one per line in a manifest file. Relative paths in
+    a manifest are relative to the folder of the manifest."""
+    if os.path.isdir(source):
+        folder = os.path.abspath(source)
+        paths = [file for file in sorted(os.listdir(folder)) if file.lower().endswith(VIDEO_EXTENSIONS)]
+    else:
+        folder = os.path.dirname(os.path.abspath(source))
+        with open(source, 'r', encoding='utf-8') as manifest:
+            paths = [line.strip() for line in manifest]
+        paths = [path for path in paths if path and not path.startswith('#')]
+    return [spudnig_new.format_path(os.path.join(folder, path)) for path in paths]
+
+
+def video_args(args, video, number):
+    """Returns the arguments of spudnig_new for one video of the corpus."""
+    name = os.path.splitext(os.path.basename(video))[0]
+    return argparse.Namespace(**vars(args), filename=video,
+                              temp_dir=posixpath.join(args.temp_root, '{:04d}_{}'.format(number, name)))
+
+
+def estimate_pose(args, openpose, keypoints_left, keypoints_right, keypoints_body):
+    """Runs the pose estimation of a video and saves the keypoints in the store in its temporary folder.
+    Returns the frames per second and the time it took. Raises a RuntimeError if OpenPose failed."""
+    start = time.perf_counter()
+    fps = spudnig_new.get_fps(args.filename)
+    (data, valid), exit_code = spudnig_new.pose_data(args, openpose, fps, keypoints_left, keypoints_right,
+                                                     keypoints_body)
+    if exit_code is None:
+        raise RuntimeError("OpenPose could not be started")
+    if exit_code == spudnig_new.INCOMPLETE:
+        raise RuntimeError("OpenPose wrote no output for some frames")
+    if exit_code != 0:
+        raise RuntimeError("OpenPose exited with code {}".format(exit_code))
+    keypoint_store.save(args.temp_dir, data, fps, args.filename, keypoints_left, keypoints_right, keypoints_body,
+                        valid)
+    return fps, time.perf_counter() - start
+
+
+def analyse(temp_dir, savefile, filetype, threshold, min_cutoff, gap_cutoff, chunk_size=None, workers=1,
+            progress_json=False):
+    """Detects the movements in the keypoint store in temp_dir and saves them. Runs in a worker process."""
+    start = time.perf_counter()
+    header = keypoint_store.read_header(temp_dir)
+    detect_progress = progress.Progress('detect', video=header['video'], json_lines=progress_json)
+    if chunk_size:
+        movements = online_movements.find_movements_chunked(temp_dir, threshold, min_cutoff, gap_cutoff,
+                                                            chunk_size, detect_progress)
+    else:
+        movements = movements2.find_movements(temp_dir, threshold, min_cutoff, gap_cutoff, workers)
+        detect_progress.finish(header['frames'], header['frames'])
+    spudnig_new.save_file(movements, savefile, filetype, header['fps'], header['video'])
+    return {'frames': header['frames'], 'movements': 0 if movements is None else len(movements[0]),
+            'result': '' if movements is None else savefile, 'analysis_seconds': time.perf_counter() - start}
+
+
+def run(args, videos, openpose, keypoints_left, keypoints_right, keypoints_body):
+    """Analyses the videos and returns the summary with a row per video, in the order of videos."""
+    # the analysis workers import this module, and do not need pandas
+    import pandas as pd
+
+    rows = [{'video': video, 'status': 'failed'} for video in videos]
+    # the analysis workers are started while pose threads are running, which forking does not handle well
+    context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=args.pose_jobs) as pose_pool, \
+            ProcessPoolExecutor(max_workers=args.analysis_jobs, mp_context=context) as analysis_pool:
+        jobs = {}
+        for number, video in enumerate(videos):
+            arguments = video_args(args, video, number)
+            jobs[pose_pool.submit(estimate_pose, arguments, openpose, keypoints_left, keypoints_right,
+                                  keypoints_body)] = ('pose', number, arguments)
+        pending = set(jobs)
+        finished = 0
+        videos_progress = progress.Progress('batch', total=len(videos), json_lines=args.progress_json)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, number, arguments = jobs.pop(future)
+                row = rows[number]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    row['error'] = '{}: {}'.format(type(e).__name__, e)
+                    finished += 1
+                    print("Failed to analyse {} ({} of {} videos done)".format(arguments.filename, finished,
+                                                                           len(videos)), flush=True)
+                    videos_progress.update(finished)
+                    continue
+                if stage == 'pose':
+                    row['fps'], row['pose_seconds'] = result
+                    savefile = posixpath.join(args.savefolder, os.path.splitext(os.path.basename(
+                        arguments.filename))[0] + args.filetype)
+                    analysis = analysis_pool.submit(analyse, arguments.temp_dir, savefile, args.filetype,
+                                                    args.threshold, args.min_cutoff, args.gap_cutoff,
+                                                    args.chunk_size, args.workers, args.progress_json)
+                    jobs[analysis] = ('analysis', number, arguments)
+                    pending.add(analysis)
+                else:
+                    row.update(result)
+                    row['status'] = 'ok' if result['movements'] else 'no movement'
+                    finished += 1
+                    print("Analysed {} ({} of {} videos done)".format(arguments.filename, finished, len(videos)),
+                          flush=True)
+                    videos_progress.update(finished)
+        videos_progress.finish()
+    return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run spudnig on a folder or manifest of videos.')
+    parser.add_argument('source', help='Folder with the videos, or a text file with the path of a video per line.')
+    parser.add_argument('threshold', type=float, help='Reliability threshold.')
+    parser.add_argument('min_cutoff', type=int, help='Minimal number of frames over which a movement should be '
+                                                     'detected to be interpreted as a movement')
+    parser.add_argument('gap_cutoff', type=int, help='Minimal number of frames between 2 movements, otherwise they '
+                                                     'are merged into 1')
+    parser.add_argument('temp_root', help='Directory in which every video gets a directory for temporary files.')
+    parser.add_argument('savefolder', help='Folder where the results and summary.csv should be in.')
+    parser.add_argument('filetype', choices=['.csv', '.json', '.eaf'], help='File type of the result files.')
+    parser.add_argument('-kpl', dest='keypoints_left', help='List of left-hand keypoints under consideration')
+    parser.add_argument('-kpr', dest='keypoints_right', help='List of right-hand keypoints under consideration')
+    parser.add_argument('-kpb', dest='keypoints_body', help='List of body keypoints under consideration')
+    parser.add_argument('--pose-jobs', dest='pose_jobs', type=int, default=1,
+                        help='Number of videos in pose estimation at the same time.')
+    parser.add_argument('--analysis-jobs', dest='analysis_jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of videos analysed at the same time, defaults to the CPU count.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes the keypoints of one video are divided over.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=None,
+                        help='Analyse the keypoints this many frames at a time.')
+    parser.add_argument('--stream', dest='stream', default=False, action='store_true',
+                        help='Ingest the frames while OpenPose is still writing them.')
+    parser.add_argument('--interpolate', dest='interpolate', default=False, action='store_true',
+                        help='Interpolate linearly across frames in which OpenPose found no person.')
+    parser.add_argument('--openpose-processes', dest='openpose_processes', type=int, default=1,
+                        help='Number of OpenPose processes that each analyse a part of one video at the same time.')
+    parser.add_argument('--no-resume', dest='resume', default=True, action='store_false',
+                        help='Rerun OpenPose from the start instead of continuing an interrupted run.')
+    parser.add_argument('--no-cache', dest='no_cache', default=False, action='store_true',
+                        help='Always run OpenPose instead of reusing its cached output.')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=pose_cache.DEFAULT_DIR,
+                        help='Folder of the cache of OpenPose output.')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=pose_cache.DEFAULT_SIZE,
+                        help='Size limit of the cache of OpenPose output in MB.')
+    parser.add_argument('--progress-json', dest='progress_json', default=False, action='store_true',
+                        help='Print the progress of every stage of every video, and of the batch, as lines of JSON.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    videos = find_videos(args.source)
+    args.temp_root = spudnig_new.format_path(os.path.abspath(args.temp_root))
+    args.savefolder = spudnig_new.format_path(os.path.abspath(args.savefolder))
+    os.chdir(spudnig_new.parent(os.path.realpath(__file__)))
+    keypoints_left = spudnig_new.keypoint_check(args.keypoints_left)
+    keypoints_right = spudnig_new.keypoint_check(args.keypoints_right)
+    keypoints_body = spudnig_new.keypoint_check(args.keypoints_body)
+    os.makedirs(args.temp_root, exist_ok=True)
+    os.makedirs(args.savefolder, exist_ok=True)
+    summary = run(args, videos, spudnig_new.openpose_path(), keypoints_left, keypoints_right, keypoints_body)
+    summary.to_csv(posixpath.join(args.savefolder, 'summary.csv'), index=False)
+    print("Analysed {} of {} videos".format((summary['status'] != 'failed').sum(), len(videos)), flush=True)
+
+
+if __name__ == '__main__':
+    atexit.register(spudnig_new.kill_child_threads)
+    main()
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of spudnig. synthetic writes OpenPose output without a video, pipeline measures the
+stages of the pipeline on it, detection measures how movement detection scales with worker
+processes, and the JSON files hold recorded runs to compare with. Run them from the spudnig
+folder as python -m benchmarks.<name>.
+"""
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how movement detection scales with the number of worker processes.
+
+Runs movements2.detect_parallel on the keypoint store of an analysed video, or on a synthetic
+recording (see synthetic) without one, with 1 up to --max-workers workers. Checks that every run
+finds the same movements as a single process, and prints the time and speedup per worker count.
+
+Run from the spudnig folder, e.g. python -m benchmarks.detection --frames 100000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import keypoint_store
+import movements2
+from benchmarks import synthetic
+
+
+def benchmark(left_hand, right_hand, pose, threshold, max_workers, repeat=1):
+    """Returns a DataFrame with the best time of repeat runs and the speedup for 1 up to max_workers workers."""
+    rows = []
+    reference = None
+    for workers in range(1, max_workers + 1):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            gestures, _ = movements2.detect_parallel(left_hand, right_hand, pose, threshold, workers)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if reference is None:
+            reference = gestures
+        elif not np.array_equal(gestures, reference):
+            raise ValueError("{} workers detected other movements than 1 worker".format(workers))
+        rows.append((workers, best, rows[0][1] / best if rows else 1.0))
+        print("{} workers: {:.2f} s".format(workers, best), flush=True)
+    return pd.DataFrame(rows, columns=['workers', 'seconds', 'speedup'])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks movement detection with 1 up to N worker processes.')
+    parser.add_argument('temp_dir', nargs='?', default=None,
+                        help='Temporary folder of spudnig_new with the keypoint store of the video; without it a '
+                             'synthetic recording is used.')
+    parser.add_argument('--frames', type=int, default=100000, help='Number of frames of the synthetic recording.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic recording.')
+    parser.add_argument('--max-workers', dest='max_workers', type=int, default=os.cpu_count() or 1,
+                        help='Largest number of workers, defaults to the CPU count.')
+    parser.add_argument('--threshold', type=float, default=0.3, help='Reliability threshold.')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of runs per worker count; the best counts.')
+    parser.add_argument('--output', default=None, help='CSV file the speedup curve is written to.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.temp_dir:
+        _, keypoints = keypoint_store.load(args.temp_dir)
+    else:
+        keypoints = synthetic.Recording(args.frames, seed=args.seed).keypoints()[0]
+    table = benchmark(keypoints['hand_left'], keypoints['hand_right'], keypoints['pose'], args.threshold,
+                      args.max_workers, args.repeat)
+    if args.output:
+        table.to_csv(args.output, index=False)
+    print(table.to_string(index=False), flush=True)
+
+
+if __name__ == '__main__':
+    main()
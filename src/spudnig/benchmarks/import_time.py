@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Measures how long importing the spudnig modules takes, with python -X importtime.
+
+Every module is imported in a fresh interpreter, repeat times, and the fastest run counts. The
+result per module is the cumulative import time and the imported modules that took longest
+themselves. Results are kept in a JSON file under a label, so the times of a change can be
+compared with an earlier run; benchmarks/import_time.json holds the recorded runs.
+
+Run from the spudnig folder, e.g. python -m benchmarks.import_time --compare lazy-imports
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+DEFAULT_MODULES = ['spudnig_new', 'batch']
+RECORD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'import_time.json')
+# the spudnig folder, where the modules are imported from
+SPUDNIG_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module, python=sys.executable):
+    """Imports module in a new interpreter and returns the (self, cumulative) import time in microseconds of
+    every module it imported, in the order -X importtime reports them."""
+    process = subprocess.run([python, '-X', 'importtime', '-c', 'import ' + module], capture_output=True,
+                             text=True, cwd=SPUDNIG_DIR)
+    if process.returncode:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, process.stderr))
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times.append((name.strip(), int(own), int(cumulative)))
+    return times
+
+
+def measure(module, repeat=5, slowest=10):
+    """Returns the cumulative import time of module in ms in the fastest of repeat runs, and the modules that
+    took longest themselves in that run."""
+    best = None
+    for _ in range(repeat):
+        times = import_times(module)
+        total = next(cumulative for name, _, cumulative in reversed(times) if name == module)
+        if best is None or total < best[0]:
+            best = total, times
+    total, times = best
+    longest = sorted(times, key=lambda time: -time[1])[:slowest]
+    return {'ms': round(total / 1000, 1), 'slowest': {name: round(own / 1000, 1) for name, own, _ in longest}}
+
+
+def load_record(path):
+    try:
+        with open(path, 'r') as record_file:
+            return json.load(record_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks the import time of spudnig modules.')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='Modules to import.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of imports per module; the fastest counts.')
+    parser.add_argument('--record', default=RECORD, help='JSON file with the recorded runs.')
+    parser.add_argument('--label', default=None, help='Save the run in the record under this label.')
+    parser.add_argument('--compare', default=None, help='Label of a recorded run to compare with.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    record = load_record(args.record)
+    reference = record.get(args.compare, {}).get('modules', {}) if args.compare else {}
+    results = {}
+    for module in args.modules:
+        results[module] = measure(module, args.repeat)
+        line = "{}: {:.1f} ms".format(module, results[module]['ms'])
+        if module in reference:
+            line += " ({:.1f} ms in {}, {:.2f}x)".format(reference[module]['ms'], args.compare,
+                                                        reference[module]['ms'] / results[module]['ms'])
+        print(line, flush=True)
+        for name, ms in results[module]['slowest'].items():
+            print("    {:8.1f} ms  {}".format(ms, name), flush=True)
+    if args.label:
+        record[args.label] = {'python': platform.python_version(), 'repeat': args.repeat, 'modules': results}
+        os.makedirs(os.path.dirname(os.path.abspath(args.record)), exist_ok=True)
+        with open(args.record, 'w') as record_file:
+            json.dump(record, record_file, indent=2)
+            record_file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks the stages of the Python pipeline on a synthetic recording (see synthetic).
+
+    ingest        ingest_openpose.ingest of the OpenPose JSON files
+    detect        movements2.detect on the ingested keypoints
+    post_process  movements2.post_process and elan_writer on the detected movement
+    velocity      plotter.create_velos of every part
+    kfe           the kinematic features of KFE_analyze, on at most --kfe-frames frames
+
+Every benchmark runs once untimed, then --repeat times, and the fastest run counts; the peak memory traced by
+tracemalloc is measured in one more run, since tracing slows the code down. Benchmarks whose
+modules cannot be imported (plotter needs matplotlib, KFE_analyze scipy) are skipped. Runs are
+kept in a JSON file under a label, benchmarks/pipeline.json by default, and a run can be
+compared with a recorded one: a benchmark that is more than --tolerance slower or uses more
+than --tolerance (and 1 MB) more memory counts as a regression, which makes the exit status 1.
+
+Run from the spudnig folder, e.g. python -m benchmarks.pipeline --frames 100000 --compare baseline
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import ingest_openpose
+import movements2
+from benchmarks import synthetic
+
+BENCHMARKS = ('ingest', 'detect', 'post_process', 'velocity', 'kfe')
+RECORD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pipeline.json')
+FPS = 25
+# growth of the peak memory in MB that is never counted as a regression, however small the reference
+MEMORY_SLACK = 1.0
+
+ALL_HANDS = list(range(21))
+ALL_BODY = list(range(25))
+
+# KFE_analyze column, part and keypoint, as process_json_data builds its table
+KFE_COLUMNS = (('R_Hand', 'hand_right', 0), ('L_Hand', 'hand_left', 0), ('R_finger', 'hand_right', 8),
+               ('L_finger', 'hand_left', 8), ('Nose', 'pose', 0), ('Neck', 'pose', 1), ('MidHip', 'pose', 8),
+               ('REye', 'pose', 15), ('LEye', 'pose', 16), ('RElb', 'pose', 3), ('LElb', 'pose', 6),
+               ('LHip', 'pose', 12), ('RHip', 'pose', 9))
+
+
+class Workload:
+    """The synthetic recording and what the benchmarks derive from it, made when first needed."""
+
+    def __init__(self, args, folder):
+        self.args = args
+        self.folder = folder
+        self.recording = synthetic.Recording(args.frames, args.movement, args.empty, args.noise, args.seed)
+        self.cache = {}
+
+    def get(self, name, make):
+        if name not in self.cache:
+            self.cache[name] = make()
+        return self.cache[name]
+
+    def json_dir(self):
+        def write():
+            synthetic.write_openpose(self.folder, self.recording)
+            return self.folder
+        return self.get('json_dir', write)
+
+    def keypoints(self):
+        return self.get('keypoints', lambda: self.recording.keypoints()[0])
+
+    def movement(self):
+        data = self.keypoints()
+        return self.get('movement', lambda: movements2.detect(data['hand_left'], data['hand_right'], data['pose'],
+                                                              self.args.threshold)[1])
+
+
+def ingest_benchmark(workload):
+    folder = workload.json_dir()
+    workers = workload.args.workers
+    return (lambda: ingest_openpose.ingest(folder, ALL_HANDS, ALL_HANDS, ALL_BODY, workers=workers)), \
+        workload.args.frames
+
+
+def detect_benchmark(workload):
+    data = workload.keypoints()
+    threshold = workload.args.threshold
+    return (lambda: movements2.detect(data['hand_left'], data['hand_right'], data['pose'], threshold)), \
+        workload.args.frames
+
+
+def post_process_benchmark(workload):
+    movement = workload.movement()
+    args = workload.args
+
+    def run():
+        processed = movements2.post_process(movement, args.min_cutoff, args.gap_cutoff)
+        return movements2.elan_writer(processed, FPS)
+    return run, args.frames
+
+
+def velocity_benchmark(workload):
+    import plotter
+
+    data = workload.keypoints()
+    return (lambda: [plotter.create_velos(data[name]) for name in ('pose', 'hand_left', 'hand_right')]), \
+        workload.args.frames
+
+
+def kfe_benchmark(workload):
+    import pandas as pd
+
+    import KFE_analyze
+
+    frames = min(workload.args.frames, workload.args.kfe_frames)
+    data = workload.keypoints()
+    df = pd.DataFrame({column: np.asarray(data[part][:frames, keypoint, :2], dtype=np.float64).tolist()
+                       for column, part, keypoint in KFE_COLUMNS})
+
+    def run():
+        KFE_analyze.calc_submoves(df, FPS)
+        KFE_analyze.calc_vert_height(df)
+        left_max, right_max = KFE_analyze.calc_maxSize(df)
+        KFE_analyze.calc_jointSize(df, left_max, right_max)
+        KFE_analyze.calc_peakVel(df['L_Hand'], FPS)
+        KFE_analyze.calc_peakVel(df['R_Hand'], FPS)
+        KFE_analyze.calc_volume_size(df)
+    return run, frames
+
+
+SETUPS = {'ingest': ingest_benchmark, 'detect': detect_benchmark, 'post_process': post_process_benchmark,
+          'velocity': velocity_benchmark, 'kfe': kfe_benchmark}
+
+
+def measure(run, repeat):
+    """Returns the seconds of the fastest of repeat runs, and the peak memory traced in one more run in MB.
+    An untimed run comes first, so lazy imports and caches are not measured. What the code prints is not
+    shown."""
+    best = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        run()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best, peak / (1 << 20)
+
+
+def benchmark(workload, names, repeat):
+    """Runs the benchmarks in names and returns their results by name."""
+    results = {}
+    for name in names:
+        try:
+            run, frames = SETUPS[name](workload)
+        except ImportError as e:
+            print("{}: skipped ({})".format(name, e), flush=True)
+            continue
+        seconds, peak = measure(run, repeat)
+        results[name] = {'frames': frames, 'seconds': round(seconds, 4), 'frames_per_sec': round(frames / seconds),
+                         'peak_mb': round(peak, 1)}
+        print("{}: {} frames in {:.3f} s ({:.0f} frames/sec), peak {:.1f} MB".format(
+            name, frames, seconds, frames / seconds, peak), flush=True)
+    return results
+
+
+def regressions(results, reference, tolerance):
+    """Returns a line for every benchmark that is slower or uses more memory than its reference, by more than
+    tolerance."""
+    found = []
+    for name, result in results.items():
+        if name not in reference:
+            continue
+        before = reference[name]
+        speed = result['frames_per_sec'] / before['frames_per_sec']
+        memory = result['peak_mb'] / before['peak_mb'] if before['peak_mb'] else 1.0
+        print("{}: {:.2f}x the throughput and {:.2f}x the peak memory of the reference".format(name, speed, memory),
+              flush=True)
+        if speed < 1 - tolerance:
+            found.append("{} throughput dropped to {:.2f}x".format(name, speed))
+        if memory > 1 + tolerance and result['peak_mb'] - before['peak_mb'] > MEMORY_SLACK:
+            found.append("{} peak memory grew to {:.2f}x".format(name, memory))
+    return found
+
+
+def load_record(path):
+    try:
+        with open(path, 'r') as record_file:
+            return json.load(record_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmarks the pipeline on synthetic OpenPose output.')
+    parser.add_argument('benchmarks', nargs='*', default=list(BENCHMARKS),
+                        help='Benchmarks to run, by default all of {}.'.format(', '.join(BENCHMARKS)))
+    parser.add_argument('--frames', type=int, default=10000, help='Number of frames of the recording.')
+    parser.add_argument('--movement', type=float, default=0.3, help='Share of frames in which a hand moves.')
+    parser.add_argument('--empty', type=float, default=0.05, help='Share of frames without a person.')
+    parser.add_argument('--noise', type=float, default=0.05, help='Standard deviation of the confidence noise.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    parser.add_argument('--threshold', type=float, default=0.3, help='Reliability threshold.')
+    parser.add_argument('--min-cutoff', dest='min_cutoff', type=int, default=4,
+                        help='Minimal number of frames of a movement.')
+    parser.add_argument('--gap-cutoff', dest='gap_cutoff', type=int, default=4,
+                        help='Minimal number of frames between 2 movements.')
+    parser.add_argument('--workers', type=int, default=1, help='Processes ingest reads the frame files with.')
+    parser.add_argument('--kfe-frames', dest='kfe_frames', type=int, default=2000,
+                        help='Largest number of frames the KFE_analyze features are computed on.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per benchmark; the fastest counts.')
+    parser.add_argument('--work-dir', dest='work_dir', default=None,
+                        help='Folder the OpenPose JSON files are written to, by default a temporary folder.')
+    parser.add_argument('--record', default=RECORD, help='JSON file with the recorded runs.')
+    parser.add_argument('--label', default=None, help='Save the run in the record under this label.')
+    parser.add_argument('--compare', default=None, help='Label of a recorded run to compare with.')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Share by which a benchmark may be slower or use more memory than the compared run.')
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error("Unknown benchmarks: {}".format(', '.join(unknown)))
+    return args
+
+
+def main():
+    args = parse_args()
+    record = load_record(args.record)
+    settings = {name: getattr(args, name) for name in ('frames', 'movement', 'empty', 'noise', 'seed', 'threshold',
+                                                       'min_cutoff', 'gap_cutoff', 'workers', 'kfe_frames')}
+    folder = args.work_dir or tempfile.mkdtemp(prefix='spudnig_benchmark_')
+    try:
+        results = benchmark(Workload(args, folder), args.benchmarks, args.repeat)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(folder, ignore_errors=True)
+    found = []
+    if args.compare:
+        reference = record.get(args.compare)
+        if reference is None:
+            raise ValueError("No run {} in {}".format(args.compare, args.record))
+        if reference['settings'] != settings:
+            print("The settings differ from those of {}".format(args.compare), flush=True)
+        found = regressions(results, reference['results'], args.tolerance)
+    if args.label:
+        record[args.label] = {'python': platform.python_version(), 'numpy': np.__version__,
+                              'cpus': os.cpu_count(), 'settings': settings, 'results': results}
+        with open(args.record, 'w') as record_file:
+            json.dump(record, record_file, indent=2)
+            record_file.write('\n')
+    for line in found:
+        print("Regression: " + line, flush=True)
+    if found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
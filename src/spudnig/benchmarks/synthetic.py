@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic OpenPose output, for measuring the pipeline without videos or OpenPose.
+
+A synthetic recording is one person at a fixed place in a 1920x1080 frame, whose hands rest and
+move in turns: a movement takes the wrist away from its rest position and back along a smooth
+arc, and the hand keypoints and the arm keypoints of the body follow the wrist. The share of
+frames in which a hand moves, the share of frames in which OpenPose found nobody, and the noise
+on the confidence of every keypoint can be set. Keypoints are generated a chunk of frames at a
+time, so even recordings of a million frames are written in little memory.
+"""
+import argparse
+import json
+import os
+import posixpath
+
+import numpy as np
+
+import ingest_openpose
+
+WIDTH = 1920
+HEIGHT = 1080
+# frames a chunk of the recording is generated in
+CHUNK = 10000
+# frames of a movement, and of a run of frames with a person
+MOVEMENT_FRAMES = (10, 60)
+PRESENT_FRAMES = (10, 300)
+# typical confidence OpenPose gives hand and body keypoints
+HAND_CONFIDENCE = 0.6
+BODY_CONFIDENCE = 0.8
+
+# body keypoints of OpenPose's BODY_25 model in a standing pose, relative to the neck
+BODY = np.array([[0, -80], [0, 0], [-70, 0], [-90, 110], [-100, 210], [70, 0], [90, 110], [100, 210],
+                 [0, 250], [-45, 250], [-50, 420], [-55, 580], [45, 250], [50, 420], [55, 580], [-15, -95],
+                 [15, -95], [-35, -90], [35, -90], [40, 610], [55, 615], [60, 595], [-40, 610], [-55, 615],
+                 [-60, 595]], dtype=np.float64)
+RIGHT_ELBOW, RIGHT_WRIST, LEFT_ELBOW, LEFT_WRIST = 3, 4, 6, 7
+
+
+def schedule(frames, share, lengths, rng):
+    """Returns the first frame, length and on/off state of alternating off and on runs covering the frames,
+    with on runs of the given (lowest, highest) lengths taking up about share of the frames."""
+    if share <= 0:
+        return np.zeros(1, dtype=np.int64), np.array([frames], dtype=np.int64), np.zeros(1, dtype=bool)
+    share = min(share, 1.0)
+    mean_on = (lengths[0] + lengths[1]) / 2
+    runs = int(1.2 * frames * share / mean_on) + 10
+    on = rng.integers(lengths[0], lengths[1] + 1, runs)
+    off = rng.exponential(mean_on * (1 - share) / share, runs).astype(np.int64)
+    length = np.column_stack((off, on)).ravel()
+    state = np.tile([False, True], runs)
+    keep = length > 0
+    length, state = length[keep], state[keep]
+    first = np.concatenate(([0], np.cumsum(length)[:-1]))
+    if first[-1] + length[-1] < frames:
+        # too few runs were drawn, the rest of the frames is off
+        first = np.append(first, first[-1] + length[-1])
+        length = np.append(length, frames)
+        state = np.append(state, False)
+    return first, length, state
+
+
+class Recording:
+    """The keypoints of a synthetic recording, generated chunk by chunk with chunk(first, stop)."""
+
+    def __init__(self, frames, movement=0.3, empty=0.05, noise=0.05, seed=0):
+        self.frames = frames
+        self.noise = noise
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.neck = np.array([WIDTH / 2, HEIGHT / 3])
+        self.hand_shape = rng.normal(0, 25, (2, 21, 2))
+        self.hand_shape[:, 0] = 0
+        # the hands move independently, each in a share of the frames that makes a hand move in movement of them
+        share = 1 - np.sqrt(1 - min(movement, 1.0))
+        self.hands = [schedule(frames, share, MOVEMENT_FRAMES, rng) for _ in range(2)]
+        # direction and distance of every movement of a hand
+        self.reach = [rng.normal(0, 120, (len(first), 2)) for first, _, _ in self.hands]
+        first, length, present = schedule(frames, 1 - empty, PRESENT_FRAMES, rng)
+        self.present = first, length, present
+
+    def offsets(self, hand, numbers):
+        """Returns how far the wrist of a hand is from its rest position in the frames."""
+        first, length, moving = self.hands[hand]
+        run = np.searchsorted(first, numbers, side='right') - 1
+        phase = (numbers - first[run]) / length[run]
+        return (moving[run] * np.sin(np.pi * phase))[:, None] * self.reach[hand][run]
+
+    def chunk(self, first, stop):
+        """Returns the (frames, keypoints, 3) arrays of the left hand, right hand and body in frames first up to
+        stop, with NaN in the frames without a person, and the frames in which a hand moves."""
+        rng = np.random.default_rng([self.seed, first])
+        numbers = np.arange(first, stop)
+        frames = len(numbers)
+        body = np.repeat((self.neck + BODY)[None], frames, axis=0)
+        body += rng.normal(0, 0.5, body.shape)
+        hands = []
+        for hand, (wrist, elbow) in enumerate(((LEFT_WRIST, LEFT_ELBOW), (RIGHT_WRIST, RIGHT_ELBOW))):
+            offset = self.offsets(hand, numbers)
+            body[:, wrist] += offset
+            body[:, elbow] += offset / 2
+            hands.append(body[:, wrist][:, None] + self.hand_shape[hand] + rng.normal(0, 0.5, (frames, 21, 2)))
+        arrays = []
+        for positions, confidence in ((hands[0], HAND_CONFIDENCE), (hands[1], HAND_CONFIDENCE),
+                                      (body, BODY_CONFIDENCE)):
+            certainty = np.clip(confidence + rng.normal(0, self.noise, positions.shape[:2]), 0, 1)
+            arrays.append(np.concatenate((positions, certainty[:, :, None]), axis=2).astype(np.float32))
+        start, length, present = self.present
+        run = np.searchsorted(start, numbers, side='right') - 1
+        for array in arrays:
+            array[~present[run]] = np.nan
+        moving = np.zeros(frames, dtype=bool)
+        for hand in range(2):
+            first_frame, _, hand_moving = self.hands[hand]
+            moving |= hand_moving[np.searchsorted(first_frame, numbers, side='right') - 1]
+        return arrays, moving & present[run]
+
+    def chunks(self, size=CHUNK):
+        for first in range(0, self.frames, size):
+            yield first, self.chunk(first, min(first + size, self.frames))
+
+    def keypoints(self):
+        """Returns the keypoints of the whole recording as ingest_openpose.ingest returns them, with the frames
+        without a person filled in."""
+        parts = [[], [], []]
+        for _, (arrays, _) in self.chunks():
+            for part, array in zip(parts, arrays):
+                part.append(array)
+        return ingest_openpose.fill_frames([np.concatenate(part) for part in parts])
+
+
+def frame_json(left_hand, right_hand, body):
+    """Returns the OpenPose JSON of a frame; a frame without a person has no people."""
+    if np.isnan(body[0, 0]):
+        return '{"version":1.3,"people":[]}'
+    body, left_hand, right_hand = [np.round(part.astype(np.float64), 3).ravel().tolist()
+                                   for part in (body, left_hand, right_hand)]
+    person = {'person_id': [-1], 'pose_keypoints_2d': body, 'face_keypoints_2d': [],
+              'hand_left_keypoints_2d': left_hand, 'hand_right_keypoints_2d': right_hand, 'pose_keypoints_3d': [],
+              'face_keypoints_3d': [], 'hand_left_keypoints_3d': [], 'hand_right_keypoints_3d': []}
+    return json.dumps({'version': 1.3, 'people': [person]})
+
+
+def write_openpose(folder, recording, name='synthetic'):
+    """Writes the recording as OpenPose does with --write_json, one file per frame."""
+    os.makedirs(folder, exist_ok=True)
+    for first, (arrays, _) in recording.chunks():
+        for offset, frame in enumerate(zip(*arrays)):
+            path = posixpath.join(folder, '{}_{:012d}_keypoints.json'.format(name, first + offset))
+            with open(path, 'w') as frame_file:
+                frame_file.write(frame_json(*frame))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Writes synthetic OpenPose output.')
+    parser.add_argument('folder', help='Folder the frame files are written to.')
+    parser.add_argument('--frames', type=int, default=10000, help='Number of frames.')
+    parser.add_argument('--movement', type=float, default=0.3, help='Share of frames in which a hand moves.')
+    parser.add_argument('--empty', type=float, default=0.05, help='Share of frames without a person.')
+    parser.add_argument('--noise', type=float, default=0.05, help='Standard deviation of the confidence noise.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    write_openpose(args.folder, Recording(args.frames, args.movement, args.empty, args.noise, args.seed))
+    print("Wrote {} frames to {}".format(args.frames, args.folder), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Checkpoints of the stages of spudnig_new in its temporary folder, so a rerun can skip what is done.
+
+The stages are, in order: pose (OpenPose wrote its frame files), ingest (the keypoint store is
+saved), masks (the movement of every frame is detected) and output (the result file is written).
+checkpoints.json records for every stage the settings it ran with and whether it completed. A
+stage only counts as done for the same settings, and recording a stage removes the checkpoints of
+the stages after it, since their input changed.
+"""
+import json
+import os
+import posixpath
+
+CHECKPOINT_NAME = 'checkpoints.json'
+STAGES = ('pose', 'ingest', 'masks', 'output')
+
+
+def video_identity(video):
+    """Identifies the video by its path, size and modification time, so a changed video is not resumed."""
+    status = os.stat(video)
+    return {'path': video, 'size': status.st_size, 'mtime': status.st_mtime}
+
+
+def load(temp_dir):
+    try:
+        with open(posixpath.join(temp_dir, CHECKPOINT_NAME), 'r') as checkpoint_file:
+            return json.load(checkpoint_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save(temp_dir, checkpoints):
+    path = posixpath.join(temp_dir, CHECKPOINT_NAME)
+    with open(path + '.partial', 'w') as checkpoint_file:
+        json.dump(checkpoints, checkpoint_file)
+    os.replace(path + '.partial', path)
+
+
+def entry(temp_dir, stage, settings):
+    """Returns the checkpoint of a stage if it ran with these settings, and otherwise None."""
+    checkpoint = load(temp_dir).get(stage)
+    if checkpoint is None or checkpoint['settings'] != json.loads(json.dumps(settings)):
+        return None
+    return checkpoint
+
+
+def done(temp_dir, stage, settings):
+    """Whether the stage completed with these settings."""
+    checkpoint = entry(temp_dir, stage, settings)
+    return checkpoint is not None and checkpoint['complete']
+
+
+def mark(temp_dir, stage, settings, complete=True):
+    """Records that the stage started (complete=False) or completed with these settings."""
+    os.makedirs(temp_dir, exist_ok=True)
+    checkpoints = load(temp_dir)
+    for later in STAGES[STAGES.index(stage) + 1:]:
+        checkpoints.pop(later, None)
+    checkpoints[stage] = {'settings': settings, 'complete': complete}
+    save(temp_dir, checkpoints)
+
+
+def complete(temp_dir, stage):
+    """Whether the last run of the stage completed, whatever its settings."""
+    checkpoint = load(temp_dir).get(stage)
+    return checkpoint is not None and checkpoint['complete']
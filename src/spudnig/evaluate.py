@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Scores detected movements against movements annotated by hand in ELAN.
+
+Both are handled as sorted arrays of intervals of frames: the first frame and the frame after
+the last frame, like movements2.runs returns. Frame-level precision and recall come from the
+number of frames in both, and movements are matched one to one by their intersection over union.
+"""
+import argparse
+import xml.etree.ElementTree as ElementTree
+
+import numpy as np
+import pandas as pd
+
+import keypoint_store
+import sweep
+
+SCORE_COLUMNS = ['frames_detected', 'frames_reference', 'frames_both', 'precision', 'recall', 'f1',
+                 'movements_detected', 'movements_reference', 'movements_matched', 'movement_precision',
+                 'movement_recall', 'mean_iou']
+
+
+def read_eaf(path, tier=None):
+    """Returns the begin and end times in ms of the annotations of a tier in an .eaf file, sorted by begin time.
+    Without a tier, the first tier that has annotations is used."""
+    root = ElementTree.parse(path).getroot()
+    slots = {slot.get('TIME_SLOT_ID'): int(slot.get('TIME_VALUE', -1)) for slot in root.iter('TIME_SLOT')}
+    for element in root.iter('TIER'):
+        if tier is not None and element.get('TIER_ID') != tier:
+            continue
+        annotations = list(element.iter('ALIGNABLE_ANNOTATION'))
+        if not annotations and tier is None:
+            continue
+        times = np.array([(slots[a.get('TIME_SLOT_REF1')], slots[a.get('TIME_SLOT_REF2')]) for a in annotations],
+                         dtype=np.int64).reshape(-1, 2)
+        times = times[(times >= 0).all(axis=1)]
+        times = times[np.argsort(times[:, 0], kind='stable')]
+        return times[:, 0], times[:, 1]
+    raise ValueError("No tier {} with annotations in {}".format(tier if tier else '', path))
+
+
+def ms_to_frames(begin, end, fps):
+    """Converts times in ms to intervals of frames, rounding both to the nearest frame. The end time is the time
+    of the last frame of an annotation, as annotation_writer writes it, so the interval ends after that frame."""
+    return (np.rint(np.asarray(begin) * fps / 1000).astype(np.int64),
+            np.rint(np.asarray(end) * fps / 1000).astype(np.int64) + 1)
+
+
+def union(starts, ends):
+    """Merges overlapping or touching intervals, sorted by start, into sorted disjoint intervals."""
+    keep = ends > starts
+    starts = starts[keep]
+    ends = ends[keep]
+    if not len(starts):
+        return starts, ends
+    reach = np.maximum.accumulate(ends)
+    new = np.concatenate(([True], starts[1:] > reach[:-1]))
+    last = np.concatenate((np.flatnonzero(new)[1:] - 1, [len(starts) - 1]))
+    return starts[new], reach[last]
+
+
+def covered_before(starts, ends, times):
+    """Returns for every time the number of frames before it that are in the disjoint intervals."""
+    before = np.concatenate(([0], np.cumsum(ends - starts)))
+    k = np.searchsorted(starts, times, side='right') - 1
+    inside = np.clip(times - starts[np.maximum(k, 0)], 0, (ends - starts)[np.maximum(k, 0)])
+    return np.where(k >= 0, before[np.maximum(k, 0)] + inside, 0)
+
+
+def overlap(starts, ends, other_starts, other_ends):
+    """Returns for every interval the number of its frames that are in the disjoint other intervals."""
+    if not len(other_starts):
+        return np.zeros(len(starts), dtype=np.int64)
+    return (covered_before(other_starts, other_ends, ends)
+            - covered_before(other_starts, other_ends, starts))
+
+
+def match(starts, ends, reference_starts, reference_ends, min_iou=0.5):
+    """Matches detected and reference intervals one to one, best intersection over union first.
+    Returns the IoU of every match with an IoU of at least min_iou."""
+    if not len(starts) or not len(reference_starts):
+        return np.zeros(0)
+    # the reference intervals that can overlap each detected interval
+    first = np.searchsorted(reference_ends, starts, side='right')
+    last = np.searchsorted(reference_starts, ends, side='left')
+    counts = np.maximum(last - first, 0)
+    detected = np.repeat(np.arange(len(starts)), counts)
+    reference = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    intersection = (np.minimum(ends[detected], reference_ends[reference])
+                    - np.maximum(starts[detected], reference_starts[reference]))
+    iou = intersection / (np.maximum(ends[detected], reference_ends[reference])
+                          - np.minimum(starts[detected], reference_starts[reference]))
+    order = np.argsort(-iou, kind='stable')
+    order = order[iou[order] >= min_iou]
+    used_detected = set()
+    used_reference = set()
+    matched = []
+    for pair in order.tolist():
+        if detected[pair] in used_detected or reference[pair] in used_reference:
+            continue
+        used_detected.add(detected[pair])
+        used_reference.add(reference[pair])
+        matched.append(iou[pair])
+    return np.array(matched)
+
+
+def score(starts, ends, reference_starts, reference_ends, min_iou=0.5):
+    """Scores detected intervals against reference intervals, both sorted by start."""
+    starts, ends = union(starts, ends)
+    reference_starts, reference_ends = union(reference_starts, reference_ends)
+    detected = int((ends - starts).sum())
+    annotated = int((reference_ends - reference_starts).sum())
+    both = int(overlap(starts, ends, reference_starts, reference_ends).sum())
+    precision = both / detected if detected else 0.0
+    recall = both / annotated if annotated else 0.0
+    matched = match(starts, ends, reference_starts, reference_ends, min_iou)
+    return {'frames_detected': detected, 'frames_reference': annotated, 'frames_both': both,
+            'precision': precision, 'recall': recall,
+            'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            'movements_detected': len(starts), 'movements_reference': len(reference_starts),
+            'movements_matched': len(matched),
+            'movement_precision': len(matched) / len(starts) if len(starts) else 0.0,
+            'movement_recall': len(matched) / len(reference_starts) if len(reference_starts) else 0.0,
+            'mean_iou': float(matched.mean()) if len(matched) else 0.0}
+
+
+def score_settings(temp_dir, reference, tier, thresholds, min_cutoffs, gap_cutoffs, min_iou=0.5):
+    """Scores every combination of the parameters on the video analysed in temp_dir against an .eaf file."""
+    header, keypoints = keypoint_store.load(temp_dir)
+    reference_starts, reference_ends = ms_to_frames(*read_eaf(reference, tier), header['fps'])
+    rows = []
+    for threshold, min_cutoff, gap_cutoff, starts, ends, _ in sweep.settings_intervals(
+            keypoints['hand_left'], keypoints['hand_right'], keypoints['pose'], thresholds, min_cutoffs,
+            gap_cutoffs):
+        scores = score(starts, ends, reference_starts, reference_ends, min_iou)
+        rows.append(dict(threshold=threshold, min_cutoff=min_cutoff, gap_cutoff=gap_cutoff, **scores))
+    return pd.DataFrame(rows, columns=['threshold', 'min_cutoff', 'gap_cutoff'] + SCORE_COLUMNS)
+
+
+def corpus_totals(table):
+    """Adds up the frame and movement counts of all videos per setting and computes the scores from the totals."""
+    counts = ['frames_detected', 'frames_reference', 'frames_both', 'movements_detected', 'movements_reference',
+              'movements_matched']
+    totals = table.groupby(['threshold', 'min_cutoff', 'gap_cutoff'], as_index=False)[counts].sum()
+    totals['precision'] = totals['frames_both'] / totals['frames_detected'].where(totals['frames_detected'] > 0)
+    totals['recall'] = totals['frames_both'] / totals['frames_reference'].where(totals['frames_reference'] > 0)
+    totals['f1'] = 2 * totals['precision'] * totals['recall'] / (totals['precision'] + totals['recall'])
+    totals['movement_precision'] = totals['movements_matched'] / totals['movements_detected'].where(
+        totals['movements_detected'] > 0)
+    totals['movement_recall'] = totals['movements_matched'] / totals['movements_reference'].where(
+        totals['movements_reference'] > 0)
+    return totals.fillna(0.0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scores detected movements against ELAN annotations.')
+    parser.add_argument('manifest', help='CSV file with a column reference (.eaf files) and a column temp_dir '
+                                         '(temporary folders of spudnig_new with the keypoint store of the video).')
+    parser.add_argument('output', help='CSV file the scores per video and setting are written to.')
+    parser.add_argument('--tier', default=None, help='Tier with the reference annotations.')
+    parser.add_argument('--min-iou', dest='min_iou', type=float, default=0.5,
+                        help='Minimal intersection over union for two movements to match.')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.3], help='Reliability thresholds.')
+    parser.add_argument('--min-cutoffs', dest='min_cutoffs', type=int, nargs='+', default=[4],
+                        help='Minimal numbers of frames of a movement.')
+    parser.add_argument('--gap-cutoffs', dest='gap_cutoffs', type=int, nargs='+', default=[4],
+                        help='Minimal numbers of frames between 2 movements.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    tables = []
+    for video in pd.read_csv(args.manifest).itertuples():
+        table = score_settings(video.temp_dir, video.reference, args.tier, args.thresholds, args.min_cutoffs,
+                               args.gap_cutoffs, args.min_iou)
+        table.insert(0, 'temp_dir', video.temp_dir)
+        tables.append(table)
+    table = pd.concat(tables, ignore_index=True)
+    table.to_csv(args.output, index=False)
+    totals = corpus_totals(table)
+    print(totals.sort_values('f1', ascending=False).head(10).to_string(index=False), flush=True)
+
+
+if __name__ == '__main__':
+    main()
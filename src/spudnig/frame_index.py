@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Index of the OpenPose frame files of a video, built once from the frame numbers in the file names.
+
+OpenPose names its output <video>_<frame number>_keypoints.json. The index lists, for every frame
+number from first to the last one found, the name of its file, or None if the file is missing.
+It is saved as frame_index.json next to the frame files, so a frame can be found by its number
+without listing or sorting the folder again.
+"""
+import json
+import os
+import posixpath
+import re
+
+FRAME_PATTERN = re.compile(r'_(\d+)_keypoints\.json$')
+INDEX_NAME = 'frame_index.json'
+
+
+def frame_number(file):
+    """Returns the frame number in the name of an OpenPose output file, or None for other files."""
+    match = FRAME_PATTERN.search(file)
+    return int(match.group(1)) if match else None
+
+
+def name_format(root):
+    """Returns the part of the frame file names in root before the frame number and the number of digits of
+    the frame number, or None if root has no frame files."""
+    for file in os.listdir(root):
+        match = FRAME_PATTERN.search(file)
+        if match:
+            return file[:match.start(1)], len(match.group(1))
+    return None
+
+
+def frame_name(prefix, number, width):
+    return '{}{:0{}d}_keypoints.json'.format(prefix, number, width)
+
+
+def move_frames(source, target, first):
+    """Moves the frame files in source to target, renumbered so the lowest frame number in source becomes
+    first, and named like the frame files already in target. Returns the number of frames moved."""
+    numbered = {}
+    for file in os.listdir(source):
+        number = frame_number(file)
+        if number is not None:
+            numbered[number] = file
+    if not numbered:
+        return 0
+    prefix, width = name_format(target) or name_format(source)
+    offset = first - min(numbered)
+    for number, file in numbered.items():
+        os.replace(posixpath.join(source, file), posixpath.join(target, frame_name(prefix, number + offset, width)))
+    return len(numbered)
+
+
+def build_index(root, first=0, frames=None):
+    """Indexes the frame files in root, starting at frame number first.
+
+    If the number of frames of the video is known, frames missing at the end are detected as well."""
+    numbered = {}
+    for file in os.listdir(root):
+        number = frame_number(file)
+        if number is not None and number >= first:
+            numbered[number] = file
+    last = max(numbered, default=first - 1)
+    if frames is not None:
+        last = max(last, first + frames - 1)
+    files = [numbered.get(number) for number in range(first, last + 1)]
+    return {'first': first, 'files': files}
+
+
+def missing_frames(index):
+    """Returns the frame numbers without a file."""
+    return [index['first'] + i for i, file in enumerate(index['files']) if file is None]
+
+
+def missing_ranges(index):
+    """Returns the (first, stop) ranges of consecutive frame numbers without a file."""
+    ranges = []
+    for number in missing_frames(index):
+        if ranges and ranges[-1][1] == number:
+            ranges[-1][1] = number + 1
+        else:
+            ranges.append([number, number + 1])
+    return [(first, stop) for first, stop in ranges]
+
+
+def frame_file(index, number):
+    """Returns the file of frame number, or None if it is missing."""
+    position = number - index['first']
+    if 0 <= position < len(index['files']):
+        return index['files'][position]
+    return None
+
+
+def frame_paths(root, index):
+    """Returns the path of every indexed frame, in frame order, with None for missing frames."""
+    return [posixpath.join(root, file) if file is not None else None for file in index['files']]
+
+
+def save_index(root, index):
+    with open(posixpath.join(root, INDEX_NAME), 'w') as index_file:
+        json.dump(index, index_file)
+
+
+def load_index(root):
+    with open(posixpath.join(root, INDEX_NAME), 'r') as index_file:
+        return json.load(index_file)
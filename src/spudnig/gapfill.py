@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Fills the frames in which OpenPose found no data for a keypoint.
+
+All functions work on (frames, keypoints, 3) arrays in which missing data is NaN, and
+do one vectorized pass over the frames.
+"""
+import numpy as np
+
+
+def validity_mask(array, min_confidence=None):
+    """Returns a (frames, keypoints) mask that is True where a keypoint has data in a frame.
+
+    If min_confidence is given, keypoints with a lower certainty count as missing as well."""
+    valid = ~np.isnan(array).any(axis=2)
+    if min_confidence is not None:
+        valid &= array[:, :, 2] >= min_confidence
+    return valid
+
+
+def fill_indices(valid):
+    """Returns for every frame and keypoint the index of the last valid frame at or before it
+    (-1 if there is none) and of the first valid frame at or after it (frames if there is none)."""
+    frames = len(valid)
+    index = np.arange(frames)[:, None]
+    forward = np.where(valid, index, -1)
+    np.maximum.accumulate(forward, axis=0, out=forward)
+    backward = np.where(valid, index, frames)
+    backward = np.minimum.accumulate(backward[::-1], axis=0)[::-1]
+    return forward, backward
+
+
+def fill(array, valid, interpolate=False):
+    """Returns a copy of array in which the invalid frames of every keypoint are filled.
+
+    Gaps take the last valid value before them, or the first valid value after them when they
+    are at the start. With interpolate, gaps between two valid frames are filled linearly instead.
+    Keypoints without any valid frame are set to 0, so they have a certainty of 0."""
+    frames = len(array)
+    if not array.size:
+        return array.copy()
+    forward, backward = fill_indices(valid)
+    source = np.where(forward >= 0, forward, backward)
+    never = source == frames
+    source[never] = 0
+    filled = np.take_along_axis(array, source[:, :, None], axis=0)
+
+    if interpolate:
+        inside = ~valid & (forward >= 0) & (backward < frames)
+        if inside.any():
+            frame, keypoint = np.nonzero(inside)
+            before = forward[frame, keypoint]
+            after = backward[frame, keypoint]
+            weight = ((frame - before) / (after - before))[:, None]
+            filled[frame, keypoint] = array[before, keypoint] * (1 - weight) + array[after, keypoint] * weight
+
+    filled[never] = 0
+    return filled
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Reads the OpenPose JSON output of a video straight into NumPy keypoint arrays.
+
+Every frame file is decoded by a pool of workers and only the keypoints selected
+with keypoint_check are kept. The result is one preallocated (frames, keypoints, 3)
+float32 array per part (hand_left, hand_right and pose), holding x, y and certainty.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import frame_index
+import gapfill
+import profiling
+import sort_openpose_output
+
+# name of the part, key in the OpenPose output and number of keypoints OpenPose writes for it
+PARTS = (('hand_left', 'hand_left_keypoints_2d', 21),
+         ('hand_right', 'hand_right_keypoints_2d', 21),
+         ('pose', 'pose_keypoints_2d', 25))
+
+
+def selected_keypoints(arg_list, count):
+    """Returns the keypoint numbers whose columns are chosen by keypoint_check."""
+    return [column // 3 for column in sort_openpose_output.keypoint_check(arg_list, 3 * count)[::3]]
+
+
+def read_frames(paths, selections):
+    """Decodes the frame files in paths and keeps only the selected keypoints of every part.
+
+    Missing frames (a path of None), frames without people and parts with a malformed keypoint
+    list are left as NaN."""
+    arrays = [np.full((len(paths), len(selection), 3), np.nan, dtype=np.float32) for selection in selections]
+    for f, path in enumerate(paths):
+        if path is None:
+            continue
+        try:
+            with open(path, "r") as read_file:
+                people = json.load(read_file)['people']
+        except (ValueError, KeyError):
+            print("Frame file " + path + " could not be read, it is treated as missing", flush=True)
+            continue
+        if not people:
+            continue
+        for array, (_, key, count), selection in zip(arrays, PARTS, selections):
+            keypoints = people[0].get(key)
+            if not selection or keypoints is None or len(keypoints) != 3 * count:
+                continue
+            array[f] = np.asarray(keypoints, dtype=np.float32).reshape(count, 3)[selection]
+    return arrays
+
+
+def part_selections(keypoints_left, keypoints_right, keypoints_body):
+    return [selected_keypoints(keypoints_left, 21), selected_keypoints(keypoints_right, 21),
+            selected_keypoints(keypoints_body, 25)]
+
+
+def fill_frames(arrays, interpolate=False):
+    """Fills the NaN frames of the arrays with gapfill and returns the filled arrays and their
+    validity masks as dicts by part name."""
+    valid = [gapfill.validity_mask(array) for array in arrays]
+    arrays = [gapfill.fill(array, mask, interpolate) for array, mask in zip(arrays, valid)]
+    names = [name for name, _, _ in PARTS]
+    return dict(zip(names, arrays)), dict(zip(names, valid))
+
+
+def select(data, valid, keypoints_left, keypoints_right, keypoints_body, interpolate=False):
+    """Takes the selected keypoints from arrays holding every keypoint of every part, like the ones
+    in the pose cache, and returns them like ingest. The arrays must have been filled without
+    interpolation; with interpolate the selected gaps are filled again, from the validity masks."""
+    selections = part_selections(keypoints_left, keypoints_right, keypoints_body)
+    selected, selected_valid = {}, {}
+    for (name, _, _), selection in zip(PARTS, selections):
+        array = np.array(data[name][:, selection], dtype=np.float32)
+        mask = np.array(valid[name][:, selection], dtype=bool)
+        if interpolate:
+            array = gapfill.fill(np.where(mask[:, :, None], array, np.nan), mask, interpolate)
+        selected[name] = array
+        selected_valid[name] = mask
+    return selected, selected_valid
+
+
+def report(index, elapsed):
+    frames = len(index['files'])
+    print("Ingested {} frames in {:.2f} s ({:.0f} frames/sec)".format(
+        frames, elapsed, frames / elapsed if elapsed else 0), flush=True)
+    missing = frame_index.missing_frames(index)
+    if missing:
+        print("{} frame files are missing, the first is frame {}".format(len(missing), missing[0]), flush=True)
+
+
+@profiling.timed('ingest')
+def ingest(root, keypoints_left, keypoints_right, keypoints_body, workers=None, executor='process',
+           interpolate=False, frames=None, progress=None):
+    """Reads the OpenPose output in root into a dict with a (frames, keypoints, 3) array per part.
+
+    Frames are ordered by their frame number; frame numbers without a file become filled frames,
+    so the time axis does not shift. The frame index is saved next to the frame files.
+
+    Also returns a dict with the (frames, keypoints) validity mask of every part, which is False
+    for the frames that were filled in by gapfill. The number of frames read so far is passed to
+    progress (see progress.Progress), if it is given."""
+    start = time.perf_counter()
+    index = frame_index.build_index(root, frames=frames)
+    frame_index.save_index(root, index)
+    paths = frame_index.frame_paths(root, index)
+    selections = part_selections(keypoints_left, keypoints_right, keypoints_body)
+    arrays = [np.full((len(paths), len(selection), 3), np.nan, dtype=np.float32) for selection in selections]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) < 2 * workers:
+        for array, chunk in zip(arrays, read_frames(paths, selections)):
+            array[:] = chunk
+    else:
+        size = max(1, -(-len(paths) // (workers * 4)))
+        bounds = range(0, len(paths), size)
+        if executor == 'process':
+            # spawned, since the caller can have threads running (the pose threads of batch.py, the jobs of worker.py)
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        else:
+            pool = ThreadPoolExecutor(max_workers=workers)
+        with pool as p:
+            results = p.map(read_frames, [paths[b:b + size] for b in bounds], [selections] * len(bounds))
+            for b, chunks in zip(bounds, results):
+                for array, chunk in zip(arrays, chunks):
+                    array[b:b + len(chunk)] = chunk
+                if progress is not None:
+                    progress.update(min(b + size, len(paths)), len(paths))
+
+    data, valid = fill_frames(arrays, interpolate)
+    report(index, time.perf_counter() - start)
+    profiling.count('frames', len(paths))
+    profiling.count('files', len(paths) - len(frame_index.missing_frames(index)))
+    if progress is not None:
+        progress.finish(len(paths), len(paths))
+    return data, valid
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compares the ingestion engine with sort_openpose.')
+    parser.add_argument('root', help='Folder with the OpenPose JSON output.')
+    parser.add_argument('--workers', type=int, default=None, help='Number of workers, defaults to the CPU count.')
+    parser.add_argument('--threads', dest='executor', default='process', action='store_const', const='thread',
+                        help='Use a thread pool instead of a process pool.')
+    parser.add_argument('--interpolate', default=False, action='store_true',
+                        help='Interpolate linearly across frames without data.')
+    parser.add_argument('--legacy', default=False, action='store_true',
+                        help='Also time sort_openpose on the same folder.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    hand, body = list(range(21)), list(range(25))
+    ingest(args.root, hand, hand, body, args.workers, args.executor, args.interpolate)
+    if args.legacy:
+        begin = time.perf_counter()
+        sort_openpose_output.sort_openpose(args.root, hand, hand, body)
+        frames = len(frame_index.load_index(args.root)['files'])
+        seconds = time.perf_counter() - begin
+        print("sort_openpose: {} frames in {:.2f} s ({:.0f} frames/sec)".format(
+            frames, seconds, frames / seconds if seconds else 0), flush=True)
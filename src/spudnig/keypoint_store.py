@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Binary on-disk store for the ingested keypoint arrays.
+
+A store is a 'keypoints' folder inside the temporary folder of a video. It holds one .npy file
+per part (hand_left, hand_right and pose) with a (frames, keypoints, 3) float32 array, a
+<part>_valid.npy file per part with the (frames, keypoints) mask of the frames that were not
+filled in by gapfill, and a header.json recording the frame count, fps, the selected keypoints
+and the source video. The arrays are opened as memory maps, so readers do not copy or parse them.
+"""
+import json
+import os
+import posixpath
+
+import numpy as np
+
+PART_NAMES = ('hand_left', 'hand_right', 'pose')
+
+CSV_NAMES = {'hand_left': 'hand_left_sample.csv', 'hand_right': 'hand_right_sample.csv', 'pose': 'sample.csv'}
+
+STORE_DIR = 'keypoints'
+HEADER = 'header.json'
+VERSION = 1
+
+
+def store_path(root):
+    return posixpath.join(root, STORE_DIR)
+
+
+def save(root, data, fps, video, keypoints_left, keypoints_right, keypoints_body, valid=None):
+    """Writes the arrays in data, and the validity masks in valid, to the store in root. The header
+    is written last, so a store without a header is incomplete."""
+    path = store_path(root)
+    os.makedirs(path, exist_ok=True)
+    for name in PART_NAMES:
+        np.save(posixpath.join(path, name + '.npy'), np.ascontiguousarray(data[name], dtype=np.float32))
+        mask = valid[name] if valid is not None else np.ones(data[name].shape[:2], dtype=bool)
+        np.save(posixpath.join(path, name + '_valid.npy'), np.ascontiguousarray(mask, dtype=bool))
+    header = {'version': VERSION,
+              'frames': int(len(data['pose'])),
+              'fps': fps,
+              'video': video,
+              'keypoints': {'hand_left': list(keypoints_left), 'hand_right': list(keypoints_right),
+                            'pose': list(keypoints_body)}}
+    with open(posixpath.join(path, HEADER), 'w') as header_file:
+        json.dump(header, header_file)
+    return header
+
+
+def read_header(root):
+    with open(posixpath.join(store_path(root), HEADER), 'r') as header_file:
+        return json.load(header_file)
+
+
+def load(root, mmap_mode='r'):
+    """Opens the store in root and returns its header and a dict with a memory-mapped array per part."""
+    header = read_header(root)
+    path = store_path(root)
+    data = {name: np.load(posixpath.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in PART_NAMES}
+    return header, data
+
+
+def load_valid(root, mmap_mode='r'):
+    """Returns a dict with the memory-mapped (frames, keypoints) validity mask of every part."""
+    path = store_path(root)
+    return {name: np.load(posixpath.join(path, name + '_valid.npy'), mmap_mode=mmap_mode) for name in PART_NAMES}
+
+
+def as_frame(array):
+    """Returns a (frames, keypoints * 3) DataFrame view on a keypoint array, in the layout of the CSVs."""
+    import pandas as pd
+
+    return pd.DataFrame(array.reshape(len(array), -1), copy=False)
+
+
+def export_csv(root, data):
+    """Writes the arrays as the CSV files sort_openpose used to write. Only meant for debugging."""
+    for name in PART_NAMES:
+        as_frame(data[name]).to_csv(posixpath.join(root, CSV_NAMES[name]), encoding='utf-8', index=False,
+                                    header=None)
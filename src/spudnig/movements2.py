@@ -5,14 +5,19 @@ Created on Tue Jun  4 17:20:50 2019
 @author: jorrip
 """
 
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from operator import itemgetter
 
-import posixpath
-import pandas as pd
-import sys
+import numpy as np
 
-# The data for the pose, right- and left-hand need to be stored in csv's
-# that can be created with the script sort_openpose_output
+import keypoint_store
+import profiling
+
+# The data for the pose, right- and left-hand need to be stored in a keypoint store
+# that can be created with the scripts ingest_openpose and keypoint_store
 
 
 def merge_gestures(l1, l2):
@@ -53,6 +58,41 @@ def rest(i, data, keypoint):
         return False
 
 
+def rest_mask(x, y):
+    """Returns rest(i, data, keypoint) for every frame i at once, given the x and y coordinates of one
+    keypoint, or of several keypoints in the columns of (frames, keypoints) arrays."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    frames = x.shape[0]
+    span = 14
+    certainty = np.zeros(x.shape, dtype=np.int64)
+    # rest compares frame i with the frames i - 7 up to and including i + 6
+    for offset in range(-span // 2, span // 2):
+        first = max(0, -offset)
+        last = min(frames, frames - offset)
+        if first >= last:
+            continue
+        certainty[first:last] += ((np.abs(x[first + offset:last + offset] - x[first:last]) < 10)
+                                  & (np.abs(y[first + offset:last + offset] - y[first:last]) < 10))
+    return certainty / span >= 0.7
+
+
+def still_mask(x, y):
+    """Returns isStill(data, idx, keypoint) for every frame idx at once, given the x and y coordinates of
+    one keypoint, or of several keypoints in the columns of (frames, keypoints) arrays."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    frames = x.shape[0]
+    count = np.zeros(x.shape, dtype=np.int64)
+    # isStill compares frame idx with the 20 frames after it
+    for offset in range(1, 21):
+        last = frames - offset
+        if last <= 0:
+            break
+        count[:last] += ((np.abs(x[:last] - x[offset:]) < 8) & (np.abs(y[:last] - y[offset:]) < 8))
+    return count / 20 > 0.7
+
+
 def frameToTime(i, fps):
     '''Converts the framenumber to hh:mm:ss:ms format'''
     ms_in_h = 3600000
@@ -94,6 +134,8 @@ def get_gestures_keypoint(data, keypoint_index, threshold):
     rest_x = 0
     rest_y = 0
     keypoint_index *= 3
+    at_rest = rest_mask(data[keypoint_index], data[keypoint_index + 1])
+    still = still_mask(data[keypoint_index], data[keypoint_index + 1])
 
     i = 0
     # fill right hand gestures 
@@ -111,7 +153,7 @@ def get_gestures_keypoint(data, keypoint_index, threshold):
 
         else:
             # update rest position
-            if rest(i, data, keypoint_index):
+            if at_rest[i]:
                 rest_x = current[keypoint_index]
                 rest_y = current[keypoint_index + 1]
                 gesture = 0
@@ -131,7 +173,7 @@ def get_gestures_keypoint(data, keypoint_index, threshold):
                     # TODO: check whether hands return to rest position in future: if so, there is a gesture from current i until it reaches rest point again
                     for t in range(i + 1, min(i + 300, data.shape[0])):
                         # if hand has returned to rest position in next 10 seconds
-                        if isStill(data, t, keypoint_index):
+                        if still[t]:
                             gesture = 1
                             returned = True
                             backToRest = t
@@ -142,7 +184,7 @@ def get_gestures_keypoint(data, keypoint_index, threshold):
                     # if hands did not return to previous rest position, check if they returned to new restposition
                     if not returned:
                         for t in range(i + 1, min(i + 300, data.shape[0])):
-                            if rest(t, data, keypoint_index):
+                            if at_rest[t]:
                                 gesture = 1
                                 returned = True
                                 backToRest = t
@@ -160,45 +202,203 @@ def get_gestures_keypoint(data, keypoint_index, threshold):
     return local_gestures
 
 
+def next_true(mask):
+    """Returns for every frame the first frame at or after it in which mask is True, or the number of frames
+    if there is none. Works along the first axis, so every column of a 2D mask is handled separately."""
+    mask = np.asarray(mask)
+    frames = mask.shape[0]
+    index = np.arange(frames).reshape((frames,) + (1,) * (mask.ndim - 1))
+    following = np.where(mask, index, frames)
+    return np.minimum.accumulate(following[::-1], axis=0)[::-1]
+
+
+def run_detector(x, y, c, threshold, at_rest, next_still, next_rest, next_certain, gestures, start, stop,
+                 rest_x=0, rest_y=0):
+    """The state machine of get_gestures_keypoint on plain arrays of one keypoint.
+
+    Handles the frames from start until stop and writes the detected movements into gestures. A movement
+    that starts before stop is followed until the keypoint is still again, so frames after stop can be
+    written as well. Every lookahead is a single read of the next_* arrays, made with next_true.
+    Returns the next frame to handle and the rest position at that frame, so a caller can continue."""
+    frames = len(x)
+    i = start
+    while i < stop:
+        # frames in which OpenPose is not certain enough are no movement and do not change the rest position
+        i = next_certain[i]
+        if i >= stop:
+            break
+        if at_rest[i]:
+            rest_x = x[i]
+            rest_y = y[i]
+        elif abs(x[i] - rest_x) > 5 or abs(y[i] - rest_y) > 5:
+            # check if it's actual movement or just a few frames
+            end = min(i + 6, frames)
+            certainty = np.count_nonzero((np.abs(x[i + 1:end] - rest_x) > 5) | (np.abs(y[i + 1:end] - rest_y) > 5))
+            if certainty / 5 >= 0.5 and i + 1 < frames:
+                # the keypoint has to be still, or at a (new) rest position, within the next 300 frames
+                horizon = min(i + 300, frames)
+                back_to_rest = next_still[i + 1]
+                if back_to_rest >= horizon:
+                    back_to_rest = next_rest[i + 1]
+                if back_to_rest < horizon:
+                    gestures[i:back_to_rest + 1] = 1
+                    rest_x = x[back_to_rest]
+                    rest_y = y[back_to_rest]
+                    i = back_to_rest
+        i += 1
+    return i, rest_x, rest_y
+
+
+def detect_keypoint(x, y, c, threshold):
+    """Array version of get_gestures_keypoint: returns the same 0/1 per frame, as an int8 array, for the x, y
+    and certainty arrays of one keypoint. It takes time linear in the number of frames."""
+    x = np.asarray(x)
+    y = np.asarray(y)
+    c = np.asarray(c)
+    frames = len(x)
+    gestures = np.zeros(max(frames, 1), dtype=np.int8)
+    if frames < 2:
+        return gestures
+    at_rest = rest_mask(x, y)
+    next_still = next_true(still_mask(x, y))
+    next_rest = next_true(at_rest)
+    next_certain = next_true(~(c < threshold))
+    run_detector(x, y, c, threshold, at_rest, next_still, next_rest, next_certain, gestures, 1, frames)
+    return gestures
+
+
+def keypoint_features(block):
+    """Computes the arrays the detector needs that do not depend on the threshold, for every keypoint of a
+    (frames, keypoints, 3) block at once. The per-keypoint arrays are rows of (keypoints, frames) arrays."""
+    block = np.asarray(block)
+    x = block[:, :, 0]
+    y = block[:, :, 1]
+    at_rest = rest_mask(x, y)
+    return {'x': np.ascontiguousarray(x.T),
+            'y': np.ascontiguousarray(y.T),
+            'c': np.ascontiguousarray(block[:, :, 2].T),
+            'at_rest': np.ascontiguousarray(at_rest.T),
+            'next_still': np.ascontiguousarray(next_true(still_mask(x, y)).T),
+            'next_rest': np.ascontiguousarray(next_true(at_rest).T)}
+
+
+def detect_features(features, threshold):
+    """Runs the detector on every keypoint of the output of keypoint_features and returns a (frames, keypoints)
+    int8 array with the movements of each keypoint, like detect_keypoint does for one."""
+    keypoints, frames = features['x'].shape
+    gestures = np.zeros((keypoints, max(frames, 1)), dtype=np.int8)
+    if frames < 2:
+        return gestures.T
+    next_certain = next_true((~(features['c'] < threshold)).T).T
+    for k in range(keypoints):
+        run_detector(features['x'][k], features['y'][k], features['c'][k], threshold, features['at_rest'][k],
+                     features['next_still'][k], features['next_rest'][k], next_certain[k], gestures[k], 1, frames)
+    return gestures.T
+
+
+def detect(left_hand, right_hand, pose, threshold):
+    """Detects the movements of all keypoints in the (frames, keypoints, 3) blocks of the left hand, right hand
+    and body in one pass. Returns the (frames, keypoints) movements per keypoint, ordered left hand, right hand,
+    body, and the per-frame movements of all keypoints merged, like merge_gestures does."""
+    block = np.concatenate([left_hand, right_hand, pose], axis=1)
+    gestures = detect_features(keypoint_features(block), threshold)
+    return gestures, gestures.any(axis=1).astype(np.int8)
+
+
+# the shared memory a worker process of detect_parallel is attached to, and the arrays on it
+shared = {}
+
+
+def attach_shared(block_name, block_shape, block_dtype, gestures_name):
+    """Initializer of the worker processes of detect_parallel."""
+    memories = [shared_memory.SharedMemory(name=block_name), shared_memory.SharedMemory(name=gestures_name)]
+    shared['memories'] = memories
+    shared['block'] = np.ndarray(block_shape, dtype=block_dtype, buffer=memories[0].buf)
+    shared['gestures'] = np.ndarray((block_shape[1], max(block_shape[0], 1)), dtype=np.int8,
+                                    buffer=memories[1].buf)
+
+
+def detect_shared(first, last, threshold):
+    """Detects the movements of keypoints first up to last of the shared block into the shared gestures."""
+    shared['gestures'][first:last] = detect_features(keypoint_features(shared['block'][:, first:last]), threshold).T
+
+
+def detect_parallel(left_hand, right_hand, pose, threshold, workers=None):
+    """detect with the keypoints divided over a pool of worker processes. The keypoints and the movements per
+    keypoint are in shared memory, so only keypoint ranges are sent to the workers."""
+    workers = workers or os.cpu_count() or 1
+    keypoints = left_hand.shape[1] + right_hand.shape[1] + pose.shape[1]
+    if workers == 1 or keypoints < 2:
+        return detect(left_hand, right_hand, pose, threshold)
+    frames = len(pose)
+    shape = (frames, keypoints, 3)
+    dtype = np.result_type(left_hand, right_hand, pose)
+    block_memory = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    gestures_memory = shared_memory.SharedMemory(create=True, size=keypoints * max(frames, 1))
+    try:
+        np.concatenate([left_hand, right_hand, pose], axis=1,
+                       out=np.ndarray(shape, dtype=dtype, buffer=block_memory.buf))
+        size = max(1, -(-keypoints // (workers * 2)))
+        bounds = range(0, keypoints, size)
+        # spawned, since the caller can have threads running (the pose threads of batch.py, the jobs of worker.py)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=min(workers, len(bounds)), mp_context=context, initializer=attach_shared,
+                                 initargs=(block_memory.name, shape, dtype, gestures_memory.name)) as p:
+            list(p.map(detect_shared, bounds, [min(b + size, keypoints) for b in bounds], [threshold] * len(bounds)))
+        gestures = np.ndarray((keypoints, max(frames, 1)), dtype=np.int8, buffer=gestures_memory.buf).T.copy()
+    finally:
+        block_memory.close()
+        block_memory.unlink()
+        gestures_memory.close()
+        gestures_memory.unlink()
+    return gestures, gestures.any(axis=1).astype(np.int8)
+
+
+def runs(gestures):
+    """Returns the first frames and the frames after the last frames of the runs of 1 in a list of zeros and ones."""
+    moving = np.concatenate(([False], np.asarray(gestures) == 1, [False]))
+    change = np.flatnonzero(moving[1:] != moving[:-1])
+    return change[0::2], change[1::2]
+
+
+def merge_gaps(starts, ends, gap_cutoff):
+    """Merges runs that have at most gap_cutoff frames between them."""
+    if len(starts) < 2:
+        return starts, ends
+    apart = starts[1:] - ends[:-1] > gap_cutoff
+    return np.concatenate((starts[:1], starts[1:][apart])), np.concatenate((ends[:-1][apart], ends[-1:]))
+
+
+def drop_short(starts, ends, min_cutoff, frames):
+    """Removes runs of at most min_cutoff frames. Like post_process, a run that lasts until the last frame is kept."""
+    keep = (ends - starts > min_cutoff) | (ends >= frames)
+    return starts[keep], ends[keep]
+
+
+def process_intervals(starts, ends, frames, min_cutoff, gap_cutoff):
+    """post_process on runs: merges gaps of at most gap_cutoff frames, then removes movements of at most
+    min_cutoff frames."""
+    starts, ends = merge_gaps(starts, ends, gap_cutoff)
+    return drop_short(starts, ends, min_cutoff, frames)
+
+
+def to_frames(starts, ends, frames):
+    """Converts runs back into a zero or one per frame."""
+    change = np.zeros(frames + 1, dtype=np.int8)
+    np.add.at(change, starts, 1)
+    np.add.at(change, ends, -1)
+    return np.cumsum(change[:-1], dtype=np.int8)
+
+
 # cutoff refers to the minimum number of frames and the minimum gap between frames
 # make two cutoff variables instead of one for both cutoffs that can be altered by a slider
 def post_process(data, min_cutoff, gap_cutoff):
-    '''Post processing of the gestures. Gestures smaller than 4 frames are removed.
-    Consecutive gestures with less than 4 frames between them are merged together.'''
-    newdata = data.copy()
-    idx = 0
-
-    # merge consecutive gestures with fewer than 4 frames between them
-    while idx < len(newdata) - 1:
-        if newdata[idx] == 1 and newdata[idx + 1] == 0:
-            try:
-                nextone = next((j, val) for j, val in enumerate(newdata[idx + 1:]) if val == 1)[0]
-            except StopIteration:
-                break
-            if nextone <= gap_cutoff:
-                for j in range(idx + 1, idx + nextone + 1):
-                    newdata[j] = 1
-            idx = idx + nextone + 1
-        else:
-            idx = idx + 1
-
-    idx = 0
-    # remove gestures that are shorter than 4 frames
-    while idx < len(newdata) - 1:
-        if newdata[idx] == 1:
-            try:
-                nextone = next((j, val) for j, val in enumerate(newdata[idx:]) if val == 0)[0]
-            except StopIteration:
-                break
-            if nextone <= min_cutoff:
-                for j in range(idx, idx + nextone + 1):
-                    newdata[j] = 0
-            idx = idx + nextone + 1
-
-        else:
-            idx = idx + 1
-
-    return newdata
+    '''Post processing of the gestures. Gestures of at most min_cutoff frames are removed.
+    Consecutive gestures with at most gap_cutoff frames between them are merged together.'''
+    starts, ends = runs(data)
+    starts, ends = process_intervals(starts, ends, len(data), min_cutoff, gap_cutoff)
+    newdata = to_frames(starts, ends, len(data))
+    return newdata.tolist() if isinstance(data, list) else newdata
 
 
 def isStill(data, idx, keypoint):
@@ -234,57 +434,96 @@ def most_certain_keypoints(data):
             next(x for x in best if x not in fingers)]
 
 
-def elan_writer(list_of_gestures, fps):
-    """Converts a list of zeros and ones for each frame into a csv that can be imported into Elan."""
-    elan = pd.DataFrame(columns=['Tier', 'Begin', 'End', 'Annotation'])
-    idx = 0
-    while idx < len(list_of_gestures) - 1:
-        val = list_of_gestures[idx]
-        if val == 1:
-            begin = frameToTime(idx, fps)  # there's a 15 frame difference between original/openpose output video
-            end = ''
-            for idx2, val2 in enumerate(list_of_gestures[idx + 1:]):
-                if val2 == 0:
-                    end = frameToTime(idx + idx2, fps)
-                    break
-            elan = elan.append({'Tier': 'Movements', 'Begin': begin, 'End': end, 'Annotation': 'movement'},
-                               ignore_index=True)
-            idx = idx + idx2 + 1
-        else:
-            idx += 1
-    return elan
+def frames_to_ms(frames, fps):
+    """Converts an array of framenumbers to milliseconds, rounded down like frameToTime."""
+    return (np.asarray(frames, dtype=np.int64) * (1000 / fps)).astype(np.int64)
 
 
-def main(root, threshold, keypoints_left, keypoints_right, keypoints_body, fps, min_cutoff, gap_cutoff):
-    try:
-        pose = pd.read_csv(posixpath.join(root, 'sample.csv'), header=None)
-        left_hand = pd.read_csv(posixpath.join(root, 'hand_left_sample.csv'), header=None)
-        right_hand = pd.read_csv(posixpath.join(root, 'hand_right_sample.csv'), header=None)
-    except pd.io.common.EmptyDataError:
+def format_ms(ms):
+    """Formats an array of milliseconds in the hh:mm:ss.ms format of frameToTime."""
+    hours, ms = np.divmod(np.asarray(ms, dtype=np.int64), 3600000)
+    minutes, ms = np.divmod(ms, 60000)
+    s, ms = np.divmod(ms, 1000)
+    return ["{}:{}:{}.{:0>3d}".format(*time) for time in zip(hours.tolist(), minutes.tolist(), s.tolist(), ms.tolist())]
+
+
+def frame_times(frames, fps):
+    """Converts an array of framenumbers to hh:mm:ss.ms strings, like frameToTime."""
+    return format_ms(frames_to_ms(frames, fps))
+
+
+def elan_frame(starts, ends, frames, fps):
+    """Builds the Elan importable table of the movements in runs. A movement that lasts until the last frame
+    has no end time, and one that only starts in the last frame is left out, as elan_writer always did."""
+    import pandas as pd
+
+    keep = starts < frames - 1
+    starts = starts[keep]
+    ends = ends[keep]
+    finished = ends < frames
+    end_times = np.array([''] * len(ends), dtype=object)
+    end_times[finished] = frame_times(ends[finished] - 1, fps)
+    return pd.DataFrame({'Tier': 'Movements', 'Begin': frame_times(starts, fps), 'End': end_times,
+                         'Annotation': 'movement'}, columns=['Tier', 'Begin', 'End', 'Annotation'],
+                        index=range(len(starts)))
+
+
+def elan_writer(list_of_gestures, fps):
+    """Converts a list of zeros and ones for each frame into a csv that can be imported into Elan."""
+    starts, ends = runs(list_of_gestures)
+    return elan_frame(starts, ends, len(list_of_gestures), fps)
+
+
+@profiling.timed('detect')
+def detect_movement(root, threshold, workers=1):
+    """Returns the merged 0/1 movement per frame of the keypoint store in root, or None if the store has no
+    frames. With more than one worker, the keypoints are divided over worker processes (see detect_parallel)."""
+    header, keypoints = keypoint_store.load(root)
+    if not header['frames']:
+        return None
+    profiling.count('keypoints', sum(keypoints[name].shape[1] for name in keypoint_store.PART_NAMES))
+    _, movement = detect_parallel(keypoints['hand_left'], keypoints['hand_right'], keypoints['pose'], threshold,
+                                  workers)
+    return movement
+
+
+@profiling.timed('post_process')
+def movement_intervals(movement, min_cutoff, gap_cutoff):
+    """Post-processes the movement per frame. Returns the runs of the movements and the number of frames."""
+    starts, ends = runs(movement)
+    starts, ends = process_intervals(starts, ends, len(movement), min_cutoff, gap_cutoff)
+    profiling.count('segments', len(starts))
+    return starts, ends, len(movement)
+
+
+def find_movements(root, threshold, min_cutoff, gap_cutoff, workers=1):
+    """Detects and post-processes the movements in the keypoint store in root. Returns the runs of the
+    movements (see runs) and the number of frames, or None if the store has no frames."""
+    movement = detect_movement(root, threshold, workers)
+    if movement is None:
+        return None
+    return movement_intervals(movement, min_cutoff, gap_cutoff)
+
+
+def select_keypoints(header, keypoints, keypoints_left, keypoints_right, keypoints_body):
+    """Returns the (frames, keypoints, 3) arrays of the left hand, right hand and body of a keypoint store with only
+    the given keypoint numbers. Raises a ValueError for keypoints the store does not hold."""
+    selected = []
+    for name, numbers in zip(keypoint_store.PART_NAMES, (keypoints_left, keypoints_right, keypoints_body)):
+        stored = header['keypoints'][name]
+        missing = [number for number in numbers if number not in stored]
+        if missing:
+            raise ValueError("The keypoint store has no {} keypoints {}".format(name, missing))
+        selected.append(keypoints[name][:, [stored.index(number) for number in numbers]])
+    return selected
+
+
+def main(root, threshold, keypoints_left, keypoints_right, keypoints_body, fps, min_cutoff, gap_cutoff, workers=1):
+    """Detects the movements of the given keypoints in the keypoint store in root and returns the Elan importable
+    table."""
+    header, keypoints = keypoint_store.load(root)
+    if not header['frames']:
         return "No movement detected"
-        sys.exit()
-
-    indices_left = range(len(keypoints_left))
-    indices_right = range(len(keypoints_right))
-    indices_body = range(len(keypoints_body))
-
-    if indices_left:
-        movement = get_gestures_keypoint(left_hand, indices_left[0], threshold)
-        for index in indices_left[1:]:
-            movement = merge_gestures(movement, get_gestures_keypoint(left_hand, index, threshold))
-        for index in indices_right:
-            movement = merge_gestures(movement, get_gestures_keypoint(right_hand, index, threshold))
-        for index in indices_body:
-            movement = merge_gestures(movement, get_gestures_keypoint(pose, index, threshold))
-    elif indices_right:
-        movement = get_gestures_keypoint(right_hand, indices_right[0], threshold)
-        for index in indices_right[1:]:
-            movement = merge_gestures(movement, get_gestures_keypoint(right_hand, index, threshold))
-        for index in indices_body:
-            movement = merge_gestures(movement, get_gestures_keypoint(pose, index, threshold))
-    elif indices_body:
-        movement = get_gestures_keypoint(right_hand, indices_body[0], threshold)
-        for index in indices_body[1:]:
-            movement = merge_gestures(movement, get_gestures_keypoint(pose, index, threshold))
-
-    return elan_writer(post_process(movement, min_cutoff, gap_cutoff), fps)
+    _, movement = detect_parallel(*select_keypoints(header, keypoints, keypoints_left, keypoints_right,
+                                                    keypoints_body), threshold, workers)
+    return elan_frame(*movement_intervals(movement, min_cutoff, gap_cutoff), fps)
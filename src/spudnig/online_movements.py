@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Detects movements in a recording that is still growing, such as a live stream.
+
+An OnlineDetector takes the keypoints frame by frame, or in batches of frames, and returns the
+movements that can no longer change. The detector looks at most 320 frames ahead of the frame it
+decides on (a return to rest within 300 frames, plus the 20 frames isStill compares with), so a
+movement is final once that many frames have been seen after it, and the gap_cutoff frames after
+it show no new movement. Only that window of frames is kept in memory, so memory does not grow
+with the length of the recording. The movements are the same as movements2.find_movements finds
+once the whole recording is known.
+"""
+import argparse
+
+import numpy as np
+
+import keypoint_store
+import movements2
+import profiling
+
+# frames before a frame that rest looks at
+HISTORY = 7
+# frames after a frame that the detector can look at: a still frame up to 299 frames ahead, which isStill
+# compares with the 20 frames after it
+LOOKAHEAD = 320
+# frames read from the keypoint store at a time by find_movements_chunked
+DEFAULT_CHUNK = 10000
+
+
+class SegmentTracker:
+    """post_process on runs that arrive in order: merges gaps of at most gap_cutoff frames and removes
+    movements of at most min_cutoff frames, emitting a movement as soon as no later run can change it."""
+
+    def __init__(self, min_cutoff, gap_cutoff):
+        self.min_cutoff = min_cutoff
+        self.gap_cutoff = gap_cutoff
+        self.open = None
+        self.pending = None
+        self.decided = 0
+
+    def add_run(self, start, end, segments):
+        if self.pending is not None and start - self.pending[1] <= self.gap_cutoff:
+            self.pending = (self.pending[0], end)
+            return
+        self.emit(segments)
+        self.pending = (start, end)
+
+    def emit(self, segments, frames=None):
+        if self.pending is None:
+            return
+        start, end = self.pending
+        if end - start > self.min_cutoff or (frames is not None and end >= frames):
+            segments.append(self.pending)
+        self.pending = None
+
+    def feed(self, moving):
+        """Takes the movement of the next frames and returns the movements that became final."""
+        segments = []
+        offset = self.decided
+        self.decided += len(moving)
+        starts, ends = movements2.runs(moving)
+        starts = (starts + offset).tolist()
+        ends = (ends + offset).tolist()
+        if self.open is not None:
+            if starts and starts[0] == offset:
+                starts[0] = self.open
+            else:
+                starts.insert(0, self.open)
+                ends.insert(0, offset)
+            self.open = None
+        if ends and ends[-1] == self.decided:
+            self.open = starts.pop()
+            ends.pop()
+        for start, end in zip(starts, ends):
+            self.add_run(start, end, segments)
+        # a movement that is followed by more than gap_cutoff frames without movement cannot grow anymore
+        if self.open is None and self.pending is not None and self.decided - self.pending[1] > self.gap_cutoff:
+            self.emit(segments)
+        return segments
+
+    def finish(self, frames):
+        segments = []
+        if self.open is not None:
+            self.add_run(self.open, frames, segments)
+            self.open = None
+        self.emit(segments, frames)
+        return segments
+
+
+class OnlineDetector:
+    """Detects movements in (frames, keypoints, 3) batches of keypoints, with the keypoints ordered like
+    movements2.detect orders them: left hand, right hand, body. push returns the movements that became
+    final, finish the remaining ones, as (start, end) pairs like movements2.runs returns."""
+
+    def __init__(self, keypoints, threshold, min_cutoff, gap_cutoff):
+        self.keypoints = keypoints
+        self.threshold = threshold
+        self.tracker = SegmentTracker(min_cutoff, gap_cutoff)
+        self.frames = 0
+        # absolute frame of the first frame in the buffers
+        self.base = 0
+        self.capacity = 0
+        self.buffers = None
+        # frames up to which rest and isStill have been computed
+        self.rest_done = 0
+        self.still_done = 0
+        # next frame to decide and rest position for every keypoint; frame 0 is never a movement
+        self.next_frame = np.ones(keypoints, dtype=np.int64)
+        self.rest = [(0, 0)] * keypoints
+        self.decided = 1
+        self.tracker.decided = 1
+
+    def allocate(self, dtype, frames):
+        self.capacity = 2 * (HISTORY + LOOKAHEAD) + frames
+        shape = (self.keypoints, self.capacity)
+        self.buffers = {'x': np.zeros(shape, dtype=dtype), 'y': np.zeros(shape, dtype=dtype),
+                        'c': np.zeros(shape, dtype=dtype), 'at_rest': np.zeros(shape, dtype=bool),
+                        'still': np.zeros(shape, dtype=bool), 'gestures': np.zeros(shape, dtype=np.int8)}
+
+    def make_room(self, frames):
+        """Drops the frames that are not needed anymore from the front of the buffers, and grows them if
+        a batch does not fit otherwise."""
+        keep = max(0, min(self.decided, self.rest_done - HISTORY, self.still_done))
+        drop = keep - self.base
+        used = self.frames - self.base
+        if used + frames <= self.capacity:
+            return
+        if drop > 0:
+            for buffer in self.buffers.values():
+                buffer[:, :used - drop] = buffer[:, drop:used]
+                buffer[:, used - drop:] = 0
+            self.base = keep
+            used -= drop
+        if used + frames > self.capacity:
+            grown = {name: np.zeros((self.keypoints, used + frames + HISTORY + LOOKAHEAD), dtype=buffer.dtype)
+                     for name, buffer in self.buffers.items()}
+            for name, buffer in self.buffers.items():
+                grown[name][:, :used] = buffer[:, :used]
+            self.buffers = grown
+            self.capacity = used + frames + HISTORY + LOOKAHEAD
+
+    def push(self, block):
+        """Adds the next frames and returns the movements that became final."""
+        block = np.asarray(block)
+        if block.ndim != 3 or block.shape[1] != self.keypoints:
+            raise ValueError("Expected a (frames, {}, 3) block of keypoints".format(self.keypoints))
+        if self.buffers is None:
+            self.allocate(block.dtype, len(block))
+        self.make_room(len(block))
+        used = self.frames - self.base
+        for part, name in enumerate(('x', 'y', 'c')):
+            self.buffers[name][:, used:used + len(block)] = block[:, :, part].T
+        self.frames += len(block)
+        return self.advance(final=False)
+
+    def finish(self):
+        """Decides the last frames once the recording has ended and returns the remaining movements."""
+        segments = self.advance(final=True) if self.buffers is not None else []
+        return segments + self.tracker.finish(max(self.frames, 1))
+
+    def update_masks(self, final):
+        """Computes rest and isStill for the frames that have enough frames around them."""
+        b = self.buffers
+        end = self.frames - self.base
+        stop = self.frames if final else self.frames - HISTORY + 1
+        if stop > self.rest_done:
+            first = max(self.base, self.rest_done - HISTORY)
+            mask = movements2.rest_mask(b['x'][:, first - self.base:end].T, b['y'][:, first - self.base:end].T)
+            b['at_rest'][:, self.rest_done - self.base:stop - self.base] = \
+                mask[self.rest_done - first:stop - first].T
+            self.rest_done = stop
+        stop = self.frames if final else self.frames - 20
+        if stop > self.still_done:
+            first = self.still_done
+            mask = movements2.still_mask(b['x'][:, first - self.base:end].T, b['y'][:, first - self.base:end].T)
+            b['still'][:, first - self.base:stop - self.base] = mask[:stop - first].T
+            self.still_done = stop
+
+    def advance(self, final):
+        """Runs the detector on the frames it can decide on and passes the decided frames to the tracker."""
+        self.update_masks(final)
+        stop = self.frames if final else self.frames - LOOKAHEAD + 1
+        if self.keypoints and self.next_frame.min() < stop:
+            b = self.buffers
+            end = self.frames - self.base
+            next_still = movements2.next_true(b['still'][:, :end].T).T
+            next_rest = movements2.next_true(b['at_rest'][:, :end].T).T
+            next_certain = movements2.next_true((~(b['c'][:, :end] < self.threshold)).T).T
+            for k in range(self.keypoints):
+                if self.next_frame[k] >= stop:
+                    continue
+                i, rest_x, rest_y = movements2.run_detector(
+                    b['x'][k, :end], b['y'][k, :end], b['c'][k, :end], self.threshold, b['at_rest'][k, :end],
+                    next_still[k], next_rest[k], next_certain[k], b['gestures'][k, :end],
+                    self.next_frame[k] - self.base, stop - self.base, *self.rest[k])
+                self.next_frame[k] = i + self.base
+                self.rest[k] = (rest_x, rest_y)
+        decided = min(int(self.next_frame.min()), self.frames) if self.keypoints else self.frames
+        segments = []
+        if decided > self.decided:
+            moving = self.buffers['gestures'][:, self.decided - self.base:decided - self.base].any(axis=0)
+            segments = self.tracker.feed(moving)
+            self.decided = decided
+        return segments
+
+
+@profiling.timed('detect')
+def find_movements_chunked(root, threshold, min_cutoff, gap_cutoff, chunk_size=DEFAULT_CHUNK, progress=None):
+    """movements2.find_movements for recordings that do not fit in memory: the keypoint store in root is read
+    chunk_size frames at a time and passed through an OnlineDetector, which keeps the frames the lookahead
+    needs between chunks. Returns the same runs and number of frames, or None if the store has no frames.
+    The number of frames pushed so far is passed to progress (see progress.Progress), if it is given."""
+    header, keypoints = keypoint_store.load(root)
+    if not header['frames']:
+        return None
+    parts = [keypoints[name] for name in ('hand_left', 'hand_right', 'pose')]
+    detector = OnlineDetector(sum(part.shape[1] for part in parts), threshold, min_cutoff, gap_cutoff)
+    segments = []
+    for first in range(0, header['frames'], chunk_size):
+        segments.extend(detector.push(np.concatenate([part[first:first + chunk_size] for part in parts], axis=1)))
+        if progress is not None:
+            progress.update(min(first + chunk_size, header['frames']), header['frames'])
+    segments.extend(detector.finish())
+    if progress is not None:
+        progress.finish(header['frames'], header['frames'])
+    starts = np.array([start for start, _ in segments], dtype=np.int64)
+    ends = np.array([end for _, end in segments], dtype=np.int64)
+    profiling.count('keypoints', detector.keypoints)
+    profiling.count('segments', len(starts))
+    return starts, ends, header['frames']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replays an analysed video through the online movement detector.')
+    parser.add_argument('temp_dir', help='Temporary folder of spudnig_new with the keypoint store of the video.')
+    parser.add_argument('--batch', type=int, default=1, help='Number of frames pushed at a time.')
+    parser.add_argument('--threshold', type=float, default=0.3, help='Reliability threshold.')
+    parser.add_argument('--min-cutoff', dest='min_cutoff', type=int, default=4,
+                        help='Minimal number of frames of a movement.')
+    parser.add_argument('--gap-cutoff', dest='gap_cutoff', type=int, default=4,
+                        help='Minimal number of frames between 2 movements.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    _, keypoints = keypoint_store.load(args.temp_dir)
+    block = np.concatenate([keypoints['hand_left'], keypoints['hand_right'], keypoints['pose']], axis=1)
+    detector = OnlineDetector(block.shape[1], args.threshold, args.min_cutoff, args.gap_cutoff)
+    segments = []
+    for first in range(0, len(block), args.batch):
+        for start, end in detector.push(block[first:first + args.batch]):
+            print("Movement {}-{} final at frame {}".format(start, end, detector.frames), flush=True)
+            segments.append((start, end))
+    for start, end in detector.finish():
+        print("Movement {}-{} final at the end".format(start, end), flush=True)
+        segments.append((start, end))
+    offline = movements2.find_movements(args.temp_dir, args.threshold, args.min_cutoff, args.gap_cutoff)
+    if offline is not None:
+        print("Same as offline detection: {}".format(segments == list(zip(*[e.tolist() for e in offline[:2]]))),
+              flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,10 @@
 import argparse
-import math
 import posixpath
-from itertools import tee
-from statistics import mean
 
 import matplotlib.pyplot as plt
-import pandas as pd
+import numpy as np
+
+import keypoint_store
 
 """
     The purpose of this script is to 
@@ -20,24 +19,13 @@ import pandas as pd
 """
 
 
-def pairwise(iterable):
-    "s -> (s0,s1), (s1,s2), (s2, s3), ..."
-    a, b = tee(iterable)
-    next(b, None)
-    return zip(a, b)
-
-
-def create_velos(df):
-    velos = []
-    for sub in range(0, df.shape[1], 3):
-        subset = df.iloc[:, sub:sub + 2]
-        keyp_velo = []
-        for (i1, row1), (i2, row2) in pairwise(subset.iterrows()):
-            keyp_velo.append(math.sqrt((row2.iloc[0] - row1.iloc[0]) ** 2
-                                       + (row2.iloc[1] - row1.iloc[1]) ** 2))
-
-        velos.append(keyp_velo)
-    return list(map(mean, zip(*velos)))
+def create_velos(keypoints):
+    """Returns the distance every frame moved from the previous one, averaged over the keypoints
+    of a (frames, keypoints, 3) array."""
+    if not keypoints.shape[1]:
+        return []
+    steps = np.diff(np.asarray(keypoints[:, :, :2], dtype=np.float64), axis=0)
+    return np.sqrt((steps ** 2).sum(axis=2)).mean(axis=1)
 
 
 def plot(velos, title, output_p):
@@ -59,7 +47,7 @@ def plot(velos, title, output_p):
     plt.clf()
 
 
-def parse_args():
+def parse_args(argv=None):
     """
     Parses given CMD arguments in a way that allows for error checking and messages accordingly.
     :return: the given CMD arguments, parsed and split -> ready to use
@@ -68,29 +56,28 @@ def parse_args():
     parser.add_argument('output_p', help='The path where plots should be saved.')
     parser.add_argument('opOutput', help='The path where OP output should be saved.')
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-"""
-    Now that all necessary functions have been defined we can start. 
-"""
+def plot_store(chosen_output_path, op_output):
+    """Plots the velocities of the body and both hands in the keypoint store in op_output."""
+    # open the keypoint store of OP output as memory maps
+    _, keypoints = keypoint_store.load(op_output)
+
+    body_velos = create_velos(keypoints['pose'])
+    hand_left_velos = create_velos(keypoints['hand_left'])
+    hand_right_velos = create_velos(keypoints['hand_right'])
 
-# getting parameters ready
-args = parse_args()
+    plot(body_velos, "Body_Movement", chosen_output_path)
+    plot(hand_left_velos, "Left_Hand_Movement", chosen_output_path)
+    plot(hand_right_velos, "Right_Hand_Movement", chosen_output_path)
 
-# 4 command line arguments are required:
-chosen_output_path = args.output_p
-op_output = args.opOutput
 
-# read in csv output of OP with pandas
-body = pd.read_csv(posixpath.join(op_output, "sample.csv"), header=None)
-hand_left = pd.read_csv(posixpath.join(op_output, "hand_left_sample.csv"), header=None)
-hand_right = pd.read_csv(posixpath.join(op_output, "hand_right_sample.csv"), header=None)
+def main(argv=None):
+    # getting parameters ready
+    args = parse_args(argv)
+    plot_store(args.output_p, args.opOutput)
 
-body_velos = create_velos(body)
-hand_left_velos = create_velos(hand_left)
-hand_right_velos = create_velos(hand_right)
 
-plot(body_velos, "Body_Movement", chosen_output_path)
-plot(hand_left_velos, "Left_Hand_Movement", chosen_output_path)
-plot(hand_right_velos, "Right_Hand_Movement", chosen_output_path)
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Cache of ingested OpenPose output, so analysing a video again does not rerun OpenPose.
+
+Entries are keyed by a hash of the video file and the OpenPose settings, and hold a keypoint
+store (see keypoint_store) with every keypoint of every part. The least recently used entries
+are removed when the cache grows over its size limit.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import threading
+
+import keypoint_store
+import video_probe
+
+DEFAULT_DIR = posixpath.join(os.path.expanduser('~').replace('\\', '/'), '.spudnig', 'pose_cache')
+DEFAULT_SIZE = 2048  # MB
+
+ALL_LEFT = list(range(21))
+ALL_RIGHT = list(range(21))
+ALL_BODY = list(range(25))
+
+# the pose threads of batch.py add entries at the same time, and each addition evicts entries
+lock = threading.Lock()
+
+
+def video_hash(video):
+    """Returns the hash of the contents of the video, remembered by video_probe while the video is unchanged."""
+    return video_probe.video_hash(video)
+
+
+def cache_key(video, settings, video_digest=None):
+    """Returns the key of a video analysed by OpenPose with the given settings. The hash of the video can be
+    passed as video_digest when it is already known."""
+    digest = hashlib.sha1((video_digest or video_hash(video)).encode('utf-8'))
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get(cache_dir, key):
+    """Returns the header, keypoint arrays and validity masks of an entry, or None if it is not cached."""
+    entry = posixpath.join(cache_dir, key)
+    try:
+        header, data = keypoint_store.load(entry)
+        valid = keypoint_store.load_valid(entry)
+    except (OSError, ValueError):
+        return None
+    os.utime(entry)
+    return header, data, valid
+
+
+def put(cache_dir, key, data, valid, fps, video, size_limit=DEFAULT_SIZE):
+    """Adds the keypoints of every keypoint of a video to the cache and evicts old entries. Parts that OpenPose
+    did not estimate have no keypoints."""
+    entry = posixpath.join(cache_dir, key)
+    # every thread writes its own partial entry, in case two threads add the same video
+    partial = '{}.{}.partial'.format(entry, threading.get_ident())
+    shutil.rmtree(partial, ignore_errors=True)
+    keypoints = [list(range(data[name].shape[1])) for name in keypoint_store.PART_NAMES]
+    keypoint_store.save(partial, data, fps, video, *keypoints, valid)
+    with lock:
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(partial, entry)
+        evict(cache_dir, size_limit)
+
+
+def entry_size(entry):
+    size = 0
+    for folder, _, files in os.walk(entry):
+        for file in files:
+            size += os.path.getsize(os.path.join(folder, file))
+    return size
+
+
+def evict(cache_dir, size_limit=DEFAULT_SIZE):
+    """Removes the least recently used entries until the cache is at most size_limit MB. Entries that another
+    process removes meanwhile are skipped."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_dir() and not entry.name.endswith('.partial'):
+            try:
+                entries.append((entry.stat().st_mtime, entry.path, entry_size(entry.path)))
+            except FileNotFoundError:
+                continue
+    entries.sort()
+    total = sum(size for _, _, size in entries)
+    for _, path, size in entries:
+        if total <= size_limit * 1024 * 1024:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
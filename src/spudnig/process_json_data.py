@@ -223,9 +223,10 @@ def make_vel_conf_plots(data_L, data_R, conf_L, conf_R, source, path):
     plt.gcf().clear()
     plt.close()
 
-main()
-
 # make sure this is not run when imported
+if __name__ == "__main__":
+    main()
+
 #if __name__ == "__main__":
 #    import sys
     #df = main()
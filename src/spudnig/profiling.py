@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Timers, counters and peak memory of the stages of a run, written to a JSON report.
+
+Nothing is measured until start is called; until then stage and count do nothing, so the
+instrumented code pays one check per call. A stage is timed with the stage context manager or
+the timed decorator, and every stage records its number of calls, seconds, the largest memory
+use of the process while it ran and optionally a cProfile dump. Peak memory is the resident set
+size (resource, not on Windows) and, with trace_memory, the peak of the memory traced by
+tracemalloc, which costs time. One run per process is measured at a time; stages running in
+worker processes are timed as a whole by the stage that starts them.
+
+The report looks like
+    {"seconds": 12.3, "max_rss_mb": 410.2,
+     "stages": {"detect": {"calls": 1, "seconds": 3.1, "max_rss_mb": 402.0, "peak_traced_mb": 96.4}, ...},
+     "counters": {"frames": 36000, "files": 36000, "keypoints": 48, "segments": 112},
+     "profiles": {"detect": "report.detect.prof"}}
+"""
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# the run being measured, or None
+report = None
+lock = threading.Lock()
+
+
+class Report:
+    """What has been measured of the run so far."""
+
+    def __init__(self, trace_memory=False, profiled=(), profile_path=None):
+        self.trace_memory = trace_memory
+        self.profiled = set(profiled)
+        self.profile_path = profile_path
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.profilers = {}
+        self.profiling = False
+        # stages that are running in each thread, innermost last, with the traced peak seen in them so far
+        self.running = threading.local()
+
+
+def max_rss_mb():
+    """Returns the largest resident set size of the process so far in MB, or None if it is not known."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def start(trace_memory=False, profiled=(), profile_path=None):
+    """Starts measuring a run. The stages in profiled are run under cProfile, and finish dumps their statistics
+    next to profile_path, as <profile_path without extension>.<stage>.prof."""
+    global report
+    report = Report(trace_memory, profiled, profile_path)
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def finish(path):
+    """Stops measuring and writes the report to path."""
+    global report
+    finished, report = report, None
+    if finished is None:
+        return
+    if finished.trace_memory:
+        tracemalloc.stop()
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    profiles = {}
+    for name, profiler in finished.profilers.items():
+        profiles[name] = profile_file(finished, name)
+        profiler.dump_stats(profiles[name])
+    for entry in finished.stages.values():
+        entry['seconds'] = round(entry['seconds'], 3)
+    result = {'seconds': round(time.perf_counter() - finished.start, 3), 'max_rss_mb': max_rss_mb(),
+              'stages': finished.stages, 'counters': finished.counters, 'profiles': profiles}
+    with open(path, 'w') as report_file:
+        json.dump(result, report_file, indent=2)
+        report_file.write('\n')
+    print("Saved profile report " + path, flush=True)
+
+
+def count(name, value=1):
+    """Adds value to a counter of the run."""
+    current = report
+    if current is None:
+        return
+    with lock:
+        current.counters[name] = current.counters.get(name, 0) + int(value)
+
+
+def profile_file(current, name):
+    base = os.path.splitext(current.profile_path or 'profile')[0]
+    return '{}.{}.prof'.format(base, name)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Measures the code in the with block as the stage name."""
+    current = report
+    if current is None:
+        yield
+        return
+    running = current.running.__dict__.setdefault('stack', [])
+    if current.trace_memory:
+        # the peak so far belongs to the enclosing stage, the peak is measured anew for this one
+        if running:
+            running[-1] = max(running[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    running.append(0)
+    profiler = None
+    with lock:
+        if name in current.profiled and not current.profiling:
+            # cProfile can only profile one stage at a time
+            current.profiling = True
+            profiler = current.profilers.setdefault(name, cProfile.Profile())
+    begin = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        seconds = time.perf_counter() - begin
+        peak = running.pop()
+        if current.trace_memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if running:
+                running[-1] = max(running[-1], peak)
+        with lock:
+            entry = current.stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['max_rss_mb'] = max_rss_mb()
+            if current.trace_memory:
+                entry['peak_traced_mb'] = max(entry.get('peak_traced_mb', 0), round(peak / (1 << 20), 1))
+            if profiler is not None:
+                current.profiling = False
+
+
+def timed(name):
+    """Decorator that measures every call of the function as the stage name."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Progress of the stages of a run: pose (OpenPose), ingest, detect and output.
+
+By default only OpenPose progress is printed, as the 'done/total' lines the UI turns into its
+progress bars. With JSON lines every stage prints machine-readable events instead, at most a
+few per second:
+    {"event": "progress", "stage": "pose", "done": 120, "total": 600, "fps": 14.2, "eta": 33.8, ...}
+    {"event": "done", "stage": "pose", "done": 600, "total": 600, "fps": 14.5, "eta": 0.0, ...}
+fps is the number of frames done per second of this run and eta the estimated seconds left;
+both are null while unknown. Events also hold the seconds since the stage started, and the
+video if one was given.
+"""
+import json
+import threading
+import time
+
+# seconds between two progress events of a stage
+INTERVAL = 0.5
+
+
+class Progress:
+    """Reports the progress of one stage. done counts frames (videos for the batch stage of batch.py) and
+    can start above 0, for a stage that continues an earlier run; only the frames of this run count for
+    fps. update can be called from several threads."""
+
+    def __init__(self, stage, total=0, done=0, video=None, json_lines=False, text=False, interval=INTERVAL):
+        self.stage = stage
+        self.total = total
+        self.first = done
+        self.done = done
+        self.video = video
+        self.json_lines = json_lines
+        self.text = text
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last = None
+        self.lock = threading.Lock()
+
+    def event(self, name):
+        seconds = time.perf_counter() - self.start
+        fps = (self.done - self.first) / seconds if seconds > 0 and self.done > self.first else None
+        eta = None
+        if fps and self.total:
+            eta = round(max(self.total - self.done, 0) / fps, 2)
+        event = {'event': name, 'stage': self.stage, 'done': self.done, 'total': self.total or None,
+                 'fps': round(fps, 2) if fps else None, 'eta': eta, 'seconds': round(seconds, 3)}
+        if self.video is not None:
+            event['video'] = self.video
+        return event
+
+    def update(self, done, total=None):
+        with self.lock:
+            self.done = done
+            if total:
+                self.total = total
+            if not self.json_lines:
+                if self.text:
+                    print("{}/{}".format(self.done, self.total), flush=True)
+                return
+            now = time.perf_counter()
+            if self.last is not None and now - self.last < self.interval and self.done < self.total:
+                return
+            self.last = now
+            print(json.dumps(self.event('progress')), flush=True)
+
+    def finish(self, done=None, total=None):
+        """Reports that the stage is done, after done of total frames."""
+        with self.lock:
+            if done is not None:
+                self.done = done
+            if total:
+                self.total = total
+            if self.json_lines:
+                print(json.dumps(self.event('done')), flush=True)
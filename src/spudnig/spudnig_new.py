@@ -1,14 +1,39 @@
 import argparse
+import contextvars
 import os
 import posixpath
+import shutil
 import subprocess
-import cv2
 import re
-import time
+import threading
 import atexit
+from concurrent.futures import ThreadPoolExecutor
 
-import sort_openpose_output
+import numpy as np
+
+import annotation_writer
+import checkpoints
+import frame_index
+import ingest_openpose
+import keypoint_store
 import movements2
+import online_movements
+import pose_cache
+import profiling
+import progress
+import stream_ingest
+import video_probe
+
+# the OpenPose processes that are killed when spudnig exits
+child_threads = []
+
+# folder in the temporary folder that the OpenPose process of create_data_split analysing the frames from a
+# frame number on writes to, and file with the detected movement per frame
+PART_DIR = 'part_{}'
+PART_PATTERN = re.compile(r'^part_(\d+)$')
+MOVEMENT_NAME = 'movement.npy'
+# exit code of run_openpose when OpenPose exited normally but frames of the video have no output
+INCOMPLETE = -1
 
 
 def format_path(any_path):
@@ -27,42 +52,351 @@ def parent(any_path, times=1):
     return any_path
 
 
-def create_data(args, openpose):
-    """Starts the analysis of the video when analyze button is clicked"""
+def openpose_settings(args):
+    """The OpenPose settings that change its output, which are part of the pose cache key. Hands are only
+    estimated if hand keypoints are selected. OpenPose finds the hands from the body, so the body is always
+    estimated."""
+    hand = bool(keypoint_check(args.keypoints_left) or keypoint_check(args.keypoints_right))
+    return {'model_pose': 'BODY_25', 'net_resolution': '-1x144', 'hand': hand}
+
+
+def openpose_command(args, openpose, json_dir, frame_first=0, frame_last=None):
+    """Returns the OpenPose command that writes the keypoints of the frames frame_first up to and including
+    frame_last (by default the last frame) of the video to json_dir."""
+    model = posixpath.join(parent(openpose, 2), "models")
+    settings = openpose_settings(args)
+    hand = ["--hand"] if settings['hand'] else []
+    frames = ["--frame_first " + str(frame_first)] if frame_first else []
+    if frame_last is not None:
+        frames.append("--frame_last " + str(frame_last))
+    return openpose + ' ' + ' '.join(
+        ["--video " + args.filename, "-num_gpu -1"] + frames + hand + ["--write_json",
+         json_dir, "--model_pose " + settings['model_pose'], "--net_resolution " + settings['net_resolution'],
+         "number_people_max 1", "--display 0", "--render_pose 0", "--model_folder " + model, "-cli_verbose 1"])
+
+
+def make_temp_dir(args):
     try:
         os.mkdir(args.temp_dir)
     except FileExistsError:
         print("Output folder already exists, not created")
 
-    model = posixpath.join(parent(openpose, 2), "models")
-    openpose_run_command = openpose + ' ' + ' '.join(
-        ["--video " + args.filename, "-num_gpu -1", "--hand", "--write_json",
-         args.temp_dir, "--model_pose BODY_25", "--net_resolution -1x144", "number_people_max 1",
-         "--display 0", "--render_pose 0", "--model_folder " + model, "-cli_verbose 1"])
+
+def follow_output(op, handle):
+    """Starts a thread that reads the output of an OpenPose process as fast as it is written, so OpenPose
+    never waits on a full pipe, and passes every line to handle. The thread runs in a copy of the context of
+    the caller, so what handle prints goes where the caller's output goes (the job of worker.py)."""
+    def follow():
+        for output in iter(op.stdout.readline, b''):
+            handle(output.decode('utf-8', errors='replace'))
+
+    reader = threading.Thread(target=contextvars.copy_context().run, args=(follow,), daemon=True)
+    reader.start()
+    return reader
+
+
+def stage_progress(args, stage, **kwargs):
+    return progress.Progress(stage, video=args.filename, json_lines=args.progress_json, **kwargs)
+
+
+def create_data(args, openpose, frame_first=0, json_dir=None, frame_last=None):
+    """Starts the analysis of the video when analyze button is clicked. OpenPose analyses frame_first up to and
+    including frame_last (by default the last frame) and writes its output to json_dir, by default the
+    temporary folder. Returns the exit code of OpenPose."""
+    json_dir = args.temp_dir if json_dir is None else json_dir
+    make_temp_dir(args)
+    os.makedirs(json_dir, exist_ok=True)
+    openpose_run_command = openpose_command(args, openpose, json_dir, frame_first, frame_last)
+    pose_progress = stage_progress(args, 'pose', text=True)
+
+    def handle(output):
+        fraction = parse_progress(output)
+        if fraction is not None:
+            pose_progress.update(*fraction)
 
     try:
         op = subprocess.Popen(openpose_run_command, stdout=subprocess.PIPE)
-        global child_threads
         child_threads.append(op)
-        while op.poll() is None:
-            time.sleep(0.25)
-            output = op.stdout.readline()
-
-            if not output:
-                break
-            output = output.decode("utf-8")
-            if is_progress(output):
-                print(extract_progress(output.strip()), flush=True)
-        op.wait()
+        reader = follow_output(op, handle)
+        exit_code = op.wait()
+        reader.join()
     except Exception as e:
         print(e, flush=True)
-
-
-def analysis(args, keypoints_left, keypoints_right, keypoints_body, fps, min_cutoff, gap_cutoff):
-    sort_openpose_output.sort_openpose(args.temp_dir, keypoints_left, keypoints_right, keypoints_body)
-
-    return movements2.main(args.temp_dir, args.threshold, keypoints_left, keypoints_right, keypoints_body, fps,
-                           min_cutoff, gap_cutoff)
+        return None
+    pose_progress.finish()
+    return exit_code
+
+
+def split_ranges(ranges, pieces):
+    """Divides the (first, stop) ranges of frames into about pieces ranges of similar length. A range with a stop
+    of None, the rest of the video, is not divided."""
+    total = sum(stop - first for first, stop in ranges if stop is not None)
+    size = max(1, -(-total // pieces))
+    split = []
+    for first, stop in ranges:
+        if stop is None:
+            split.append((first, stop))
+            continue
+        bounds = np.linspace(first, stop, -(-(stop - first) // size) + 1).astype(np.int64).tolist()
+        split.extend((start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end)
+    return split
+
+
+def part_dir(temp_dir, first):
+    return posixpath.join(temp_dir, PART_DIR.format(first))
+
+
+def collect_part(temp_dir, first):
+    """Moves the frame files of the part folder of the range starting at first into the temporary folder, with
+    their frame numbers in the whole video, and removes the part folder."""
+    json_dir = part_dir(temp_dir, first)
+    if os.path.isdir(json_dir):
+        frame_index.move_frames(json_dir, temp_dir, first)
+        shutil.rmtree(json_dir, ignore_errors=True)
+
+
+def collect_parts(temp_dir, keep=True):
+    """Collects the part folders an interrupted run left in the temporary folder, or removes them without keep."""
+    if not os.path.isdir(temp_dir):
+        return
+    for name in os.listdir(temp_dir):
+        match = PART_PATTERN.match(name)
+        if match is None or not os.path.isdir(posixpath.join(temp_dir, name)):
+            continue
+        if keep:
+            collect_part(temp_dir, int(match.group(1)))
+        else:
+            shutil.rmtree(posixpath.join(temp_dir, name), ignore_errors=True)
+
+
+def create_data_split(args, openpose, ranges, frames, processes):
+    """Runs OpenPose on the (first, stop) ranges of frames, with a stop of None for the rest of the video,
+    divided into parts that up to processes OpenPose processes analyse at the same time. Every process writes
+    to the part folder of its range, whose frame files are moved into the temporary folder with their frame
+    numbers in the whole video as soon as the process exits, so a part that finished is kept when the run is
+    interrupted. Progress is reported for all processes together. Returns 0 if every process succeeded, and
+    otherwise the exit code of a process that did not."""
+    make_temp_dir(args)
+    parts = split_ranges(ranges, processes)
+    remaining = sum(stop - first for first, stop in ranges if stop is not None)
+    done_before = max(frames - remaining, 0)
+    done = [0]
+    lock = threading.Lock()
+    pose_progress = stage_progress(args, 'pose', total=frames, done=done_before, text=True)
+
+    def handle(output):
+        if is_progress(output):
+            with lock:
+                done[0] += 1
+                pose_progress.update(done_before + done[0])
+
+    def run_part(first, stop):
+        # frames left in the part folder by an interrupted run are kept
+        collect_part(args.temp_dir, first)
+        json_dir = part_dir(args.temp_dir, first)
+        os.makedirs(json_dir)
+        op = subprocess.Popen(openpose_command(args, openpose, json_dir, first, None if stop is None else stop - 1),
+                              stdout=subprocess.PIPE)
+        child_threads.append(op)
+        reader = follow_output(op, handle)
+        exit_code = op.wait()
+        reader.join()
+        collect_part(args.temp_dir, first)
+        return exit_code
+
+    # every part runs in its own copy of the caller's context, like the threads of follow_output
+    context = contextvars.copy_context()
+    try:
+        with ThreadPoolExecutor(max_workers=processes) as pool:
+            exit_codes = list(pool.map(lambda part: context.copy().run(run_part, *part), parts))
+    except Exception as e:
+        print(e, flush=True)
+        exit_codes = [None]
+    pose_progress.finish()
+    return next((code for code in exit_codes if code != 0), 0)
+
+
+def missing_output(temp_dir, frames):
+    """Returns the frame index of the frame files in the temporary folder. frames is the number of frames of the
+    video, or 0 if it is not known."""
+    if not os.path.isdir(temp_dir):
+        return {'first': 0, 'files': [None] * frames}
+    return frame_index.build_index(temp_dir, frames=frames or None)
+
+
+def pose_gaps(temp_dir, frames):
+    """Returns the (first, stop) ranges of frames that an interrupted OpenPose run did not write, with a stop of
+    None for the rest of the video if its number of frames is not known. The frame written last before a gap
+    may be incomplete, so it is removed and analysed again."""
+    index = missing_output(temp_dir, frames)
+    ranges = frame_index.missing_ranges(index)
+    if not frames:
+        ranges.append((len(index['files']), None))
+    gaps = []
+    for first, stop in ranges:
+        before = frame_index.frame_file(index, first - 1)
+        if before is not None:
+            os.remove(posixpath.join(temp_dir, before))
+            first -= 1
+        if gaps and gaps[-1][1] == first:
+            first = gaps.pop()[0]
+        gaps.append((first, stop))
+    return gaps
+
+
+@profiling.timed('pose')
+def run_openpose(args, openpose):
+    """Runs OpenPose on the video. If an earlier run on the same video with the same settings stopped before
+    the end, the frames of the parts it finished are kept, OpenPose is run again on every range of frames it has
+    no output of, and the new frames are added to the earlier ones. The pose stage is complete once every frame
+    of the video has output.
+    Returns the exit code of OpenPose, 0 if it had already analysed the video, None if it could not run, or
+    INCOMPLETE if it exited normally but frames are still missing."""
+    settings = dict(openpose_settings(args), video=checkpoints.video_identity(args.filename))
+    resumed = False
+    if args.resume:
+        if checkpoints.done(args.temp_dir, 'pose', settings):
+            print("OpenPose already analysed " + args.filename, flush=True)
+            return 0
+        resumed = checkpoints.entry(args.temp_dir, 'pose', settings) is not None
+    checkpoints.mark(args.temp_dir, 'pose', settings, complete=False)
+    frames = get_frame_count(args.filename)
+    collect_parts(args.temp_dir, keep=resumed)
+    gaps = pose_gaps(args.temp_dir, frames) if resumed else [(0, frames or None)]
+    processes = args.openpose_processes if frames else 1
+    if gaps == [(0, frames or None)] and processes <= 1:
+        exit_code = create_data(args, openpose)
+    else:
+        for first, _ in gaps if resumed else []:
+            print("Resuming OpenPose at frame {}".format(first), flush=True)
+        exit_code = create_data_split(args, openpose, gaps, frames, max(processes, 1))
+    missing = frame_index.missing_frames(missing_output(args.temp_dir, frames))
+    if exit_code == 0 and missing:
+        print("OpenPose wrote no output for {} frames, the first is frame {}".format(len(missing), missing[0]),
+              flush=True)
+        exit_code = INCOMPLETE
+    if exit_code == 0:
+        checkpoints.mark(args.temp_dir, 'pose', settings)
+    return exit_code
+
+
+def pose_complete(args, exit_code):
+    """Whether OpenPose exited normally and wrote a frame file for every frame of the video."""
+    if exit_code != 0:
+        return False
+    frames = get_frame_count(args.filename)
+    index = frame_index.build_index(args.temp_dir, frames=frames or None)
+    return bool(frames) and len(index['files']) == frames and not frame_index.missing_frames(index)
+
+
+def video_frames(args):
+    """Returns the number of frames of the video, or None if it is not known, so frames missing at the end of
+    the OpenPose output are filled in as well."""
+    return get_frame_count(args.filename) or None
+
+
+def ingest(args, keypoints_left, keypoints_right, keypoints_body, interpolate=None):
+    interpolate = args.interpolate if interpolate is None else interpolate
+    return ingest_openpose.ingest(args.temp_dir, keypoints_left, keypoints_right, keypoints_body,
+                                  interpolate=interpolate, frames=video_frames(args),
+                                  progress=stage_progress(args, 'ingest'))
+
+
+def stream_data(args, openpose, keypoints_left, keypoints_right, keypoints_body, interpolate=None):
+    """Runs OpenPose while the frames it writes are ingested. Returns the keypoints and the exit code of
+    OpenPose."""
+    interpolate = args.interpolate if interpolate is None else interpolate
+    ingestor = stream_ingest.StreamingIngestor(args.temp_dir, keypoints_left, keypoints_right, keypoints_body,
+                                               interpolate=interpolate)
+    ingestor.start()
+    exit_code = None
+    try:
+        exit_code = run_openpose(args, openpose)
+    finally:
+        ingest_progress = stage_progress(args, 'ingest')
+        with profiling.stage('ingest'):
+            keypoints = ingestor.finish(video_frames(args))
+    frames = len(keypoints[0]['pose'])
+    profiling.count('frames', frames)
+    ingest_progress.finish(frames, frames)
+    return keypoints, exit_code
+
+
+def pose_data(args, openpose, fps, keypoints_left, keypoints_right, keypoints_body):
+    """Returns the ingested keypoints of the video, from the pose cache if the video was analysed with
+    the same OpenPose settings before, and otherwise by running OpenPose and adding its output to the cache.
+    Also returns the exit code of OpenPose, which is 0 for cached keypoints."""
+    if args.no_cache:
+        if args.stream:
+            return stream_data(args, openpose, keypoints_left, keypoints_right, keypoints_body)
+        exit_code = run_openpose(args, openpose)
+        return ingest(args, keypoints_left, keypoints_right, keypoints_body), exit_code
+
+    settings = openpose_settings(args)
+    video_digest = pose_cache.video_hash(args.filename)
+    key = pose_cache.cache_key(args.filename, settings, video_digest)
+    cached = pose_cache.get(args.cache_dir, key)
+    if cached is None and not settings['hand']:
+        # the output of a run with hands has every body keypoint as well
+        cached = pose_cache.get(args.cache_dir, pose_cache.cache_key(args.filename, dict(settings, hand=True),
+                                                                     video_digest))
+    if cached is not None:
+        print("Using the cached OpenPose output of " + args.filename, flush=True)
+        _, data, valid = cached
+        exit_code = 0
+    else:
+        hands = pose_cache.ALL_LEFT, pose_cache.ALL_RIGHT
+        every = (hands if settings['hand'] else ([], [])) + (pose_cache.ALL_BODY,)
+        if args.stream:
+            (data, valid), exit_code = stream_data(args, openpose, *every, interpolate=False)
+        else:
+            exit_code = run_openpose(args, openpose)
+            data, valid = ingest(args, *every, interpolate=False)
+        # the output of an OpenPose run that failed or stopped early is used, but not cached
+        if pose_complete(args, exit_code):
+            with profiling.stage('cache'):
+                pose_cache.put(args.cache_dir, key, data, valid, fps, args.filename, args.cache_size)
+    keypoints = ingest_openpose.select(data, valid, keypoints_left, keypoints_right, keypoints_body,
+                                       args.interpolate)
+    return keypoints, exit_code
+
+
+def keypoint_settings(args, keypoints_left, keypoints_right, keypoints_body):
+    """The settings that the keypoint store depends on, which make up the checkpoint of the ingest stage."""
+    return {'video': checkpoints.video_identity(args.filename), 'openpose': openpose_settings(args),
+            'keypoints': [keypoints_left, keypoints_right, keypoints_body], 'interpolate': args.interpolate}
+
+
+@profiling.timed('save_keypoints')
+def save_keypoints(args, keypoints, keypoints_left, keypoints_right, keypoints_body, fps):
+    data, valid = keypoints
+    keypoint_store.save(args.temp_dir, data, fps, args.filename, keypoints_left, keypoints_right, keypoints_body,
+                        valid)
+    if args.csv:
+        with profiling.stage('csv_write'):
+            keypoint_store.export_csv(args.temp_dir, data)
+
+
+def analysis(args, min_cutoff, gap_cutoff):
+    """Detects the movements in the keypoint store. The movement per frame is saved, so a rerun with the
+    same threshold only has to post-process it."""
+    detect_progress = stage_progress(args, 'detect')
+    if args.chunk_size:
+        # only a chunk of the store is in memory at a time
+        return online_movements.find_movements_chunked(args.temp_dir, args.threshold, min_cutoff, gap_cutoff,
+                                                       args.chunk_size, detect_progress)
+    settings = {'threshold': args.threshold}
+    movement_path = posixpath.join(args.temp_dir, MOVEMENT_NAME)
+    if args.resume and checkpoints.done(args.temp_dir, 'masks', settings):
+        movement = np.load(movement_path)
+    else:
+        movement = movements2.detect_movement(args.temp_dir, args.threshold, args.workers)
+        if movement is None:
+            return None
+        np.save(movement_path, movement)
+        checkpoints.mark(args.temp_dir, 'masks', settings)
+    detect_progress.finish(len(movement), len(movement))
+    return movements2.movement_intervals(movement, min_cutoff, gap_cutoff)
 
 
 def is_progress(output):
@@ -73,36 +407,38 @@ def extract_progress(output):
     return output.split()[-1][:-3]
 
 
-def save_file(data, savefile, output_folder, filetype):
-    """Saves the Elan importable file on a location selected by the user."""
+def parse_progress(output):
+    """Returns the frame and the number of frames of an OpenPose progress line, or None for other lines."""
+    if not is_progress(output):
+        return None
+    match = re.match(r"(\d+)/(\d+)$", extract_progress(output.strip()))
+    return (int(match.group(1)), int(match.group(2))) if match else None
 
-    # TODO Don't write to savefile but to another file and then convert.
+
+def result_path(savefile, filetype):
     if not savefile.endswith(filetype):
         savefile = savefile[0:len(savefile) - 4] + filetype
-    data.to_csv(savefile, header=False)
-    csv_file = open(savefile)
-    print(csv_file)
-
-    # TODO convert to json
-
-    # data.to_json(savefile)
-    # reader = csv.DictReader(csvfile, fieldnames=("idk yet"))
-    # json_output = json.dumps([row for row in reader])
-    # json_file = open(savefile, 'w')
-    # json_file.write(json_output)
-
-    # TODO convert to eaf
-    # shutil.rmtree(output_folder, True) TODO this should be removed, right?
-    # try:
-    #     os.remove('hand_left_sample.csv')
-    #     os.remove('hand_right_sample.csv')
-    #     os.remove('sample.csv')
-    # except OSError as e:
-    #     print("File cannot be removed.", flush=True)
-    #     print(e, flush=True)
-
-
-def parse_args():
+    return savefile
+
+
+@profiling.timed('output')
+def save_file(movements, savefile, filetype, fps, video):
+    """Saves the Elan importable file on a location selected by the user."""
+    if movements is None:
+        print("No movement detected", flush=True)
+        return
+    savefile = result_path(savefile, filetype)
+    starts, ends, frames = movements
+    if filetype == '.eaf':
+        annotation_writer.write_eaf(savefile, starts, ends, frames, fps, video)
+    elif filetype == '.json':
+        annotation_writer.write_json(savefile, starts, ends, frames, fps)
+    else:
+        movements2.elan_frame(starts, ends, frames, fps).to_csv(savefile, header=False)
+    print("Saved " + savefile, flush=True)
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='Run spudnig.')
     parser.add_argument('--gpu', dest='gpu', default=False, action='store_true',
                         help='Whether the GPU should be used instead of the CPU.')
@@ -120,18 +456,47 @@ def parse_args():
     parser.add_argument('-kpb', dest='keypoints_body', help='List of body keypoints under consideration')
     parser.add_argument('filetype', choices=['.csv', '.json', '.eaf'], default='csv', action='store',
                         help='File type of the file the result is written to.')
-    return parser.parse_args()
+    parser.add_argument('--stream', dest='stream', default=False, action='store_true',
+                        help='Ingest the frames while OpenPose is still writing them.')
+    parser.add_argument('--interpolate', dest='interpolate', default=False, action='store_true',
+                        help='Interpolate linearly across frames in which OpenPose found no person.')
+    parser.add_argument('--no-cache', dest='no_cache', default=False, action='store_true',
+                        help='Always run OpenPose instead of reusing its cached output.')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=pose_cache.DEFAULT_DIR,
+                        help='Folder of the cache of OpenPose output.')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=pose_cache.DEFAULT_SIZE,
+                        help='Size limit of the cache of OpenPose output in MB.')
+    parser.add_argument('--csv', dest='csv', default=False, action='store_true',
+                        help='Also write the keypoints to CSV files in the temporary folder, for debugging.')
+    parser.add_argument('--openpose-processes', dest='openpose_processes', type=int, default=1,
+                        help='Number of OpenPose processes that each analyse a part of the video at the same time.')
+    parser.add_argument('--no-resume', dest='resume', default=True, action='store_false',
+                        help='Redo every stage instead of continuing from the checkpoints in the temporary folder.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes the keypoints are divided over to detect movements; 0 uses '
+                             'every CPU.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=None,
+                        help='Analyse the keypoints this many frames at a time, for recordings that do not fit '
+                             'in memory (e.g. {}).'.format(online_movements.DEFAULT_CHUNK))
+    parser.add_argument('--progress-json', dest='progress_json', default=False, action='store_true',
+                        help='Print the progress of every stage as lines of JSON instead of OpenPose frame counts.')
+    parser.add_argument('--profile', dest='profile', default=None,
+                        help='Write the time, counters and peak memory of every stage to this JSON file.')
+    parser.add_argument('--profile-memory', dest='profile_memory', default=False, action='store_true',
+                        help='Also trace the peak memory Python allocates in every stage, which slows the run down.')
+    parser.add_argument('--profile-stage', dest='profile_stages', action='append', default=[],
+                        help='Run this stage under cProfile and save its statistics next to the --profile report; '
+                             'can be given more than once.')
+    return parser.parse_args(argv)
 
 
 def get_fps(video):
-    capture = cv2.VideoCapture(video)
+    return video_probe.probe(video)['fps']
 
-    if int(cv2.getVersionMajor()) < 3:
-        fps = capture.get(cv2.cv.CV_CAP_PROP_FPS)
-    else:
-        fps = capture.get(cv2.CAP_PROP_FPS)
-    capture.release()
-    return fps
+
+def get_frame_count(video):
+    """Returns the number of frames of the video, or 0 if it is not known."""
+    return video_probe.probe(video)['frames']
 
 
 def keypoint_check(arg_list):
@@ -141,25 +506,61 @@ def keypoint_check(arg_list):
         return list(map(int, arg_list[1:-1].split(",")))
 
 
-def init():
+def openpose_path():
+    wd = format_path(parent(os.path.realpath(__file__)))
+    return posixpath.join(parent(wd, 2), "openpose_cpu", "bin", "OpenPoseDemo.exe")
+
+
+def init(argv=None):
     os.chdir(parent(os.path.realpath(__file__)))
-    args = parse_args()
+    args = parse_args(argv)
     keypoints_left = keypoint_check(args.keypoints_left)
     keypoints_right = keypoint_check(args.keypoints_right)
     keypoints_body = keypoint_check(args.keypoints_body)
-    wd = format_path(os.getcwd())
-    openpose = posixpath.join(parent(wd, 2), "openpose_cpu", "bin", "OpenPoseDemo.exe")
     fps = get_fps(args.filename)
-    return args, openpose, fps, keypoints_left, keypoints_right, keypoints_body
+    return args, openpose_path(), fps, keypoints_left, keypoints_right, keypoints_body
+
 
+def main(argv=None):
+    """Runs spudnig with the command line arguments in argv, by default those of the process. Returns the
+    result file, or None if no movement was detected."""
+    args, openpose, fps, keypoints_left, keypoints_right, keypoints_body = init(argv)
+    if not args.profile:
+        return run(args, openpose, fps, keypoints_left, keypoints_right, keypoints_body)
+    profiling.start(args.profile_memory, args.profile_stages, args.profile)
+    try:
+        return run(args, openpose, fps, keypoints_left, keypoints_right, keypoints_body)
+    finally:
+        profiling.finish(args.profile)
 
-def main():
-    args, openpose, fps, keypoints_left, keypoints_right, keypoints_body = init()
-    create_data(args, openpose)
-    data = analysis(args, keypoints_left, keypoints_right, keypoints_body, fps, args.min_cutoff,
-                    args.gap_cutoff)
-    savefile = posixpath.join(args.savefolder, os.path.split(args.filename)[-1])
-    save_file(data, savefile, args.temp_dir, args.filetype)
+
+def run(args, openpose, fps, keypoints_left, keypoints_right, keypoints_body):
+    settings = keypoint_settings(args, keypoints_left, keypoints_right, keypoints_body)
+    if args.resume and checkpoints.done(args.temp_dir, 'ingest', settings):
+        print("Using the keypoints ingested before in " + args.temp_dir, flush=True)
+    else:
+        # the arrays are only referenced here, so they are freed once the store is saved (see --chunk-size)
+        save_keypoints(args, pose_data(args, openpose, fps, keypoints_left, keypoints_right, keypoints_body)[0],
+                       keypoints_left, keypoints_right, keypoints_body, fps)
+        # keypoints of an OpenPose run that stopped early are analysed, but ingested again on a rerun
+        pose = checkpoints.load(args.temp_dir).get('pose')
+        if pose is None or pose['complete']:
+            checkpoints.mark(args.temp_dir, 'ingest', settings)
+
+    savefile = result_path(posixpath.join(args.savefolder, os.path.split(args.filename)[-1]), args.filetype)
+    settings = {'threshold': args.threshold, 'min_cutoff': args.min_cutoff, 'gap_cutoff': args.gap_cutoff,
+                'savefile': savefile}
+    if args.resume and checkpoints.done(args.temp_dir, 'output', settings) and os.path.exists(savefile):
+        print("Saved " + savefile, flush=True)
+        return savefile
+    movements = analysis(args, args.min_cutoff, args.gap_cutoff)
+    output_progress = stage_progress(args, 'output')
+    save_file(movements, savefile, args.filetype, fps, args.filename)
+    if movements is None:
+        return None
+    output_progress.finish(movements[2], movements[2])
+    checkpoints.mark(args.temp_dir, 'output', settings)
+    return savefile
 
 
 def kill_child_threads():
@@ -169,6 +570,5 @@ def kill_child_threads():
 
 
 if __name__ == '__main__':
-    child_threads = []
     atexit.register(kill_child_threads)
     main()
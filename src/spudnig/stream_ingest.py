@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Ingests the OpenPose output while OpenPose is still running.
+
+OpenPose writes one JSON file per frame into the temporary folder. A StreamingIngestor thread
+watches that folder and parses every frame file as soon as the file of the next frame appears,
+so only the frames written last are left to parse when OpenPose exits.
+"""
+import os
+import posixpath
+import threading
+import time
+
+import numpy as np
+
+import frame_index
+import ingest_openpose
+
+
+class StreamingIngestor(threading.Thread):
+    """Parses the frame files in root in the background until finish is called."""
+
+    def __init__(self, root, keypoints_left, keypoints_right, keypoints_body, interpolate=False, interval=0.25):
+        super().__init__(daemon=True)
+        self.root = root
+        self.selections = ingest_openpose.part_selections(keypoints_left, keypoints_right, keypoints_body)
+        self.interpolate = interpolate
+        self.interval = interval
+        self.exited = threading.Event()
+        self.error = None
+        # file name before the frame number and the number of digits OpenPose uses for it
+        self.prefix = None
+        self.width = None
+        self.next_number = 0
+        self.parsed = set()
+        self.streamed = 0
+        self.chunks = []
+
+    def run(self):
+        try:
+            while not self.exited.wait(self.interval):
+                self.poll()
+            self.streamed = len(self.parsed)
+            self.poll(final=True)
+        except Exception as e:
+            self.error = e
+
+    def frame_path(self, number):
+        return posixpath.join(self.root, frame_index.frame_name(self.prefix, number, self.width))
+
+    def find_prefix(self):
+        if os.path.isdir(self.root):
+            self.prefix, self.width = frame_index.name_format(self.root) or (None, None)
+
+    def poll(self, final=False):
+        """Parses the frames that are completely written. A frame is complete once the file of the next
+        frame exists; after OpenPose exited every remaining frame file is parsed."""
+        if self.prefix is None:
+            self.find_prefix()
+        numbers = []
+        if self.prefix is not None:
+            while os.path.exists(self.frame_path(self.next_number)):
+                if not final and not os.path.exists(self.frame_path(self.next_number + 1)):
+                    break
+                numbers.append(self.next_number)
+                self.next_number += 1
+        if numbers:
+            self.parse(numbers, [self.frame_path(number) for number in numbers])
+        if final and os.path.isdir(self.root):
+            # frames after a gap in the numbering are not reached by the sequential probing
+            index = frame_index.build_index(self.root)
+            rest = [number for number, file in enumerate(index['files'], index['first'])
+                    if file is not None and number not in self.parsed]
+            if rest:
+                self.parse(rest, [posixpath.join(self.root, frame_index.frame_file(index, number))
+                                  for number in rest])
+
+    def parse(self, numbers, paths):
+        self.chunks.append((np.asarray(numbers), ingest_openpose.read_frames(paths, self.selections)))
+        self.parsed.update(numbers)
+
+    def finish(self, frames=None):
+        """Waits for the last frames to be parsed once OpenPose has exited, and returns the keypoint
+        arrays and validity masks like ingest_openpose.ingest."""
+        start = time.perf_counter()
+        self.exited.set()
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+        index = frame_index.build_index(self.root, frames=frames)
+        frame_index.save_index(self.root, index)
+        arrays = [np.full((len(index['files']), len(selection), 3), np.nan, dtype=np.float32)
+                  for selection in self.selections]
+        for numbers, chunks in self.chunks:
+            positions = numbers - index['first']
+            for array, chunk in zip(arrays, chunks):
+                array[positions] = chunk
+        data, valid = ingest_openpose.fill_frames(arrays, self.interpolate)
+        print("Parsed {} frames while OpenPose was running".format(self.streamed), flush=True)
+        ingest_openpose.report(index, time.perf_counter() - start)
+        return data, valid
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluates many combinations of threshold, min_cutoff and gap_cutoff on one analysed video.
+
+The coordinates, certainties and rest/stillness masks do not depend on these parameters, so they
+are computed once. The detector runs once per threshold, and the post-processing of all cutoffs
+is done on the movement intervals at once. The result is a table with the number of movements
+and the part of the video they cover for every combination.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import keypoint_store
+import movements2
+
+COLUMNS = ['threshold', 'min_cutoff', 'gap_cutoff', 'movements', 'frames_moving', 'coverage']
+
+
+def threshold_runs(left_hand, right_hand, pose, thresholds):
+    """Yields every threshold with the runs of the movements detected with it, before post-processing, and the
+    number of frames. The input of the detector is computed only once."""
+    features = movements2.keypoint_features(np.concatenate([left_hand, right_hand, pose], axis=1))
+    for threshold in thresholds:
+        movement = movements2.detect_features(features, threshold).any(axis=1)
+        starts, ends = movements2.runs(movement)
+        yield threshold, starts, ends, len(movement)
+
+
+def settings_intervals(left_hand, right_hand, pose, thresholds, min_cutoffs, gap_cutoffs):
+    """Yields every combination of the parameters with the runs of the movements movements2.find_movements
+    finds with it, and the number of frames."""
+    for threshold, starts, ends, frames in threshold_runs(left_hand, right_hand, pose, thresholds):
+        for gap_cutoff in gap_cutoffs:
+            merged_starts, merged_ends = movements2.merge_gaps(starts, ends, gap_cutoff)
+            for min_cutoff in min_cutoffs:
+                yield (threshold, min_cutoff, gap_cutoff) + movements2.drop_short(
+                    merged_starts, merged_ends, min_cutoff, frames) + (frames,)
+
+
+def sweep(left_hand, right_hand, pose, thresholds, min_cutoffs, gap_cutoffs):
+    """Returns a DataFrame with the movements found in the (frames, keypoints, 3) blocks for every combination
+    of the parameters. Movements are counted as elan_writer writes them."""
+    rows = []
+    for threshold, min_cutoff, gap_cutoff, starts, ends, frames in settings_intervals(
+            left_hand, right_hand, pose, thresholds, min_cutoffs, gap_cutoffs):
+        # elan_writer leaves out a movement that only starts in the last frame
+        written = starts < frames - 1
+        frames_moving = int((ends - starts)[written].sum())
+        rows.append((threshold, min_cutoff, gap_cutoff, int(written.sum()), frames_moving, frames_moving / frames))
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sweeps the movement detection parameters of an analysed video.')
+    parser.add_argument('temp_dir', help='Temporary folder of spudnig_new with the keypoint store of the video.')
+    parser.add_argument('output', help='CSV file the table is written to.')
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[0.3], help='Reliability thresholds.')
+    parser.add_argument('--min-cutoffs', dest='min_cutoffs', type=int, nargs='+', default=[4],
+                        help='Minimal numbers of frames of a movement.')
+    parser.add_argument('--gap-cutoffs', dest='gap_cutoffs', type=int, nargs='+', default=[4],
+                        help='Minimal numbers of frames between 2 movements.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    _, keypoints = keypoint_store.load(args.temp_dir)
+    table = sweep(keypoints['hand_left'], keypoints['hand_right'], keypoints['pose'], args.thresholds,
+                  args.min_cutoffs, args.gap_cutoffs)
+    table.to_csv(args.output, index=False)
+    print("Evaluated {} combinations".format(len(table)), flush=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+import annotation_writer
+import evaluate
+
+
+@pytest.mark.parametrize('fps', [25, 29.97, 60])
+def test_written_annotations_score_perfectly(tmp_path, fps):
+    starts = np.array([0, 10, 57, 300])
+    ends = np.array([4, 31, 58, 400])
+    frames = 400
+    path = str(tmp_path / 'movements.eaf')
+    annotation_writer.write_eaf(path, starts, ends, frames, fps, 'video.mp4')
+
+    reference_starts, reference_ends = evaluate.ms_to_frames(*evaluate.read_eaf(path), fps)
+    np.testing.assert_array_equal(reference_starts, starts)
+    np.testing.assert_array_equal(reference_ends, ends)
+    scores = evaluate.score(starts, ends, reference_starts, reference_ends)
+    assert scores['mean_iou'] == 1.0
+    assert scores['movements_matched'] == len(starts)
+    assert scores['precision'] == scores['recall'] == 1.0
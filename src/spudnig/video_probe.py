@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Frame rate, frame count and resolution of videos, remembered so a video is only opened once.
+
+Reading them means importing cv2 and opening the video, which takes longer than the rest of a
+rerun needs. The properties, and the hash of the contents that pose_cache uses, are kept in a
+small JSON file per video, keyed by its path, size and modification time, so a changed video
+is probed again. cv2 is only imported when a video actually has to be opened.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import threading
+
+DEFAULT_DIR = posixpath.join(os.path.expanduser('~').replace('\\', '/'), '.spudnig', 'video_probe')
+
+PROPERTIES = ('fps', 'frames', 'width', 'height')
+
+# records read or written by this process, by key
+records = {}
+records_lock = threading.Lock()
+
+
+def probe_key(video):
+    """Returns the key of the video in its current state."""
+    status = os.stat(video)
+    identity = [os.path.abspath(video).replace('\\', '/'), status.st_size, status.st_mtime_ns]
+    return hashlib.sha1(json.dumps(identity).encode('utf-8')).hexdigest()
+
+
+def load_record(cache_dir, key):
+    with records_lock:
+        if key in records:
+            return dict(records[key])
+    try:
+        with open(posixpath.join(cache_dir, key + '.json'), 'r') as record_file:
+            return json.load(record_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_record(cache_dir, key, record):
+    """Remembers the record in this process and on disk. The video is probed again next time if the
+    record cannot be written."""
+    with records_lock:
+        records[key] = dict(record)
+    path = posixpath.join(cache_dir, key + '.json')
+    partial = '{}.{}.partial'.format(path, os.getpid())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(partial, 'w') as record_file:
+            json.dump(record, record_file)
+        os.replace(partial, path)
+    except OSError:
+        pass
+
+
+def read_properties(video):
+    """Opens the video with cv2 and returns its properties. The frame count and resolution are 0 if cv2 does
+    not know them."""
+    import cv2
+
+    capture = cv2.VideoCapture(video)
+    if int(cv2.getVersionMajor()) < 3:
+        names = (cv2.cv.CV_CAP_PROP_FPS, cv2.cv.CV_CAP_PROP_FRAME_COUNT, cv2.cv.CV_CAP_PROP_FRAME_WIDTH,
+                 cv2.cv.CV_CAP_PROP_FRAME_HEIGHT)
+    else:
+        names = (cv2.CAP_PROP_FPS, cv2.CAP_PROP_FRAME_COUNT, cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT)
+    fps, frames, width, height = [capture.get(name) for name in names]
+    capture.release()
+    return {'fps': fps, 'frames': max(int(frames), 0), 'width': max(int(width), 0), 'height': max(int(height), 0)}
+
+
+def probe(video, cache_dir=DEFAULT_DIR):
+    """Returns the fps, frames, width and height of the video."""
+    key = probe_key(video)
+    record = load_record(cache_dir, key)
+    if not all(name in record for name in PROPERTIES):
+        properties = read_properties(video)
+        # a video that cv2 could not open is not remembered
+        if not properties['fps']:
+            return properties
+        record.update(properties)
+        save_record(cache_dir, key, record)
+    return {name: record[name] for name in PROPERTIES}
+
+
+def file_hash(video, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(video, 'rb') as video_file:
+        for block in iter(lambda: video_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def video_hash(video, cache_dir=DEFAULT_DIR):
+    """Returns the SHA-1 of the contents of the video, which is only computed again if the video changed."""
+    key = probe_key(video)
+    record = load_record(cache_dir, key)
+    if 'sha1' not in record:
+        record['sha1'] = file_hash(video)
+        save_record(cache_dir, key, record)
+    return record['sha1']
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Long-lived worker that runs spudnig jobs sent to it as JSON messages, so that the interpreter
+starts and the modules are imported only once, instead of once per analysis or plot.
+
+Every message is a line of JSON with an id and a job:
+    {"id": 1, "job": "analyze", "args": [...]}      the command line arguments of spudnig_new.py
+    {"id": 2, "job": "plot", "args": [...]}         the command line arguments of plotter.py
+    {"id": 3, "job": "rethreshold", "temp_dir": ..., "threshold": ..., "min_cutoff": ..., "gap_cutoff": ...}
+                                                    with optionally "savefile" and "filetype"
+    {"id": 4, "job": "ping"}
+    {"job": "shutdown"}
+A job is answered with {"id": ..., "status": "ok", "result": ...} or {"id": ..., "status": "error",
+"error": ...}, and every line it prints is passed on as {"id": ..., "output": ...}. Jobs run at the same
+time in a pool of threads, except analyze jobs with --profile: profiling measures the whole process, so
+they run alone. The keypoint stores and the movements detected in them are kept in memory,
+so a rethreshold job on a recently analysed video only post-processes.
+
+Messages are read from stdin and answered on stdout, or with --port exchanged over TCP connections to
+localhost.
+"""
+import argparse
+import atexit
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import posixpath
+import socketserver
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
+
+# plots are only saved, and they are made outside the main thread
+matplotlib.use('Agg')
+
+import keypoint_store
+import movements2
+import plotter
+import spudnig_new
+
+# number of keypoint stores, and of movements detected in them, that are kept in memory
+CACHED_STORES = 8
+CACHED_MOVEMENTS = 32
+
+# the job the code runs for; threads that spudnig_new starts for a job run in a copy of its context
+current_job = contextvars.ContextVar('current_job', default=None)
+plot_lock = threading.Lock()
+
+
+class JobGate:
+    """Lets jobs run at the same time, except the jobs that have to run alone. A job that has to run alone
+    waits for the running jobs to finish, and jobs that arrive meanwhile wait for it."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.running = 0
+        self.alone = False
+        self.waiting_alone = 0
+
+    @contextlib.contextmanager
+    def enter(self, alone=False):
+        with self.condition:
+            if alone:
+                self.waiting_alone += 1
+                self.condition.wait_for(lambda: self.running == 0)
+                self.waiting_alone -= 1
+                self.alone = True
+            else:
+                self.condition.wait_for(lambda: not self.alone and not self.waiting_alone)
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                if alone:
+                    self.alone = False
+                self.condition.notify_all()
+
+
+gate = JobGate()
+
+
+class Connection:
+    """Sends messages as lines of JSON to a binary stream, one message at a time."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        line = (json.dumps(message) + '\n').encode('utf-8')
+        with self.lock:
+            self.stream.write(line)
+            self.stream.flush()
+
+
+class Job:
+    """The connection and id of a running job, and the part of a line it printed that is not sent yet."""
+
+    def __init__(self, connection, id):
+        self.connection = connection
+        self.id = id
+        self.buffer = ''
+        # the threads of a job print at the same time
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.buffer += text
+            *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            self.connection.send({'id': self.id, 'output': line})
+
+    def flush_buffer(self):
+        with self.lock:
+            rest, self.buffer = self.buffer, ''
+        if rest:
+            self.connection.send({'id': self.id, 'output': rest})
+
+
+class JobOutput:
+    """Replaces sys.stdout: a line printed by a job, also from the threads it starts, is sent to the connection
+    of the job, anything printed outside of a job goes to fallback."""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def write(self, text):
+        running = current_job.get()
+        if running is None:
+            return self.fallback.write(text)
+        running.write(text)
+        return len(text)
+
+    def flush(self):
+        if current_job.get() is None:
+            self.fallback.flush()
+
+
+def store_version(temp_dir):
+    """Changes whenever the keypoint store in temp_dir is saved again."""
+    return os.stat(posixpath.join(keypoint_store.store_path(temp_dir), keypoint_store.HEADER)).st_mtime_ns
+
+
+@functools.lru_cache(maxsize=CACHED_STORES)
+def cached_store(temp_dir, version):
+    return keypoint_store.load(temp_dir, mmap_mode=None)
+
+
+@functools.lru_cache(maxsize=CACHED_MOVEMENTS)
+def cached_movement(temp_dir, version, threshold):
+    header, keypoints = cached_store(temp_dir, version)
+    if not header['frames']:
+        return None
+    _, movement = movements2.detect(keypoints['hand_left'], keypoints['hand_right'], keypoints['pose'], threshold)
+    movement.flags.writeable = False
+    return movement
+
+
+def analyze(message):
+    return spudnig_new.main([str(arg) for arg in message['args']])
+
+
+def profiled(message):
+    """Whether the message is an analyze job with --profile, which profiles the whole process."""
+    return message.get('job') == 'analyze' and any(str(arg).split('=')[0] == '--profile'
+                                                   for arg in message.get('args', []))
+
+
+def plot(message):
+    # pyplot keeps one current figure for the whole process
+    with plot_lock:
+        plotter.main([str(arg) for arg in message['args']])
+
+
+def rethreshold(message):
+    """Detects the movements in an analysed video again with other parameters, and writes them to savefile
+    if it is given. Returns the frames of the movements."""
+    temp_dir = message['temp_dir']
+    version = store_version(temp_dir)
+    header, _ = cached_store(temp_dir, version)
+    movement = cached_movement(temp_dir, version, float(message['threshold']))
+    movements = None
+    if movement is not None:
+        movements = movements2.movement_intervals(movement, int(message['min_cutoff']), int(message['gap_cutoff']))
+    savefile = message.get('savefile')
+    if savefile:
+        filetype = message.get('filetype', os.path.splitext(savefile)[1])
+        savefile = spudnig_new.result_path(savefile, filetype)
+        spudnig_new.save_file(movements, savefile, filetype, header['fps'], header['video'])
+    starts, ends = movements[:2] if movements is not None else ([], [])
+    return {'frames': header['frames'], 'fps': header['fps'], 'savefile': savefile if movements else None,
+            'movements': [[int(start), int(end)] for start, end in zip(starts, ends)]}
+
+
+def ping(message):
+    return 'pong'
+
+
+JOBS = {'analyze': analyze, 'plot': plot, 'rethreshold': rethreshold, 'ping': ping}
+
+
+def run_job(connection, message):
+    job = Job(connection, message.get('id'))
+    token = current_job.set(job)
+    try:
+        with gate.enter(alone=profiled(message)):
+            reply = {'id': job.id, 'status': 'ok', 'result': JOBS[message.get('job')](message)}
+    except KeyError as e:
+        reply = {'id': job.id, 'status': 'error', 'error': 'Unknown job or missing field {}'.format(e)}
+    except (Exception, SystemExit) as e:
+        reply = {'id': job.id, 'status': 'error', 'error': '{}: {}'.format(type(e).__name__, e)}
+    finally:
+        current_job.reset(token)
+        job.flush_buffer()
+    connection.send(reply)
+
+
+def serve(lines, connection, pool):
+    """Runs the jobs in lines until they run out or a shutdown message arrives. Returns whether the worker
+    should shut down."""
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            message = json.loads(line)
+        except ValueError:
+            connection.send({'status': 'error', 'error': 'Invalid JSON message'})
+            continue
+        if message.get('job') == 'shutdown':
+            connection.send({'id': message.get('id'), 'status': 'ok', 'result': None})
+            return True
+        pool.submit(run_job, connection, message)
+    return False
+
+
+def serve_socket(port, pool):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            if serve(self.rfile, Connection(self.wfile), pool):
+                threading.Thread(target=self.server.shutdown).start()
+
+    socketserver.ThreadingTCPServer.daemon_threads = True
+    with socketserver.ThreadingTCPServer(('127.0.0.1', port), Handler) as server:
+        print(json.dumps({'port': server.server_address[1]}), file=sys.__stdout__, flush=True)
+        server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Runs spudnig jobs sent as JSON messages.')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Listen on this port of localhost instead of stdin and stdout; 0 picks a free port, '
+                             'which is printed.')
+    parser.add_argument('--jobs', type=int, default=4, help='Number of jobs that run at the same time.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.chdir(spudnig_new.parent(os.path.realpath(__file__)))
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        if args.port is not None:
+            sys.stdout = JobOutput(sys.__stdout__)
+            serve_socket(args.port, pool)
+        else:
+            # messages go to the original stdout; anything else written to it, also by child processes,
+            # goes to stderr
+            connection = Connection(os.fdopen(os.dup(sys.stdout.fileno()), 'wb'))
+            sys.stdout.flush()
+            os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+            sys.stdout = JobOutput(sys.stderr)
+            serve(sys.stdin.buffer, connection, pool)
+
+
+if __name__ == '__main__':
+    atexit.register(spudnig_new.kill_child_threads)
+    main()